@@ -0,0 +1,90 @@
+"""Measures how much memory participants take up.
+
+Compares the slotted Participant against the layout it replaced, where
+every instance had its own __dict__ along with its own backpack dict and
+healed list. Both are built from the same synthetic states used by the
+storage benchmark.
+
+Run it from the repository root:
+
+    python -m benchmarks.memory --users 100000
+"""
+
+import argparse
+import dataclasses
+import datetime
+import gc
+import tracemalloc
+import typing
+
+from cogs import virus
+from benchmarks.storage import synthetic_state
+
+@dataclasses.dataclass
+class LegacyParticipant:
+    member_id: int
+    infected: bool = False
+    healer: bool = False
+    masked: bool = False
+    immunocompromised: typing.Optional[bool] = None
+    infected_since: typing.Optional[datetime.datetime] = None
+    death: typing.Optional[datetime.datetime] = None
+    sickness: int = 0
+    backpack: typing.Dict[str, bool] = dataclasses.field(default_factory=dict)
+    healed: typing.List[int] = dataclasses.field(default_factory=list)
+    last_heal: typing.Optional[datetime.datetime] = None
+    immune_until: typing.Optional[datetime.datetime] = None
+    pda_cooldown: typing.Optional[datetime.datetime] = None
+
+    def __post_init__(self):
+        # Record used to keep the version in the instance dict as well
+        self._version = 1
+
+def fields_of(participant):
+    data = {field.name: getattr(participant, field.name) for field in dataclasses.fields(virus.Participant)}
+    data['backpack'] = dict(data['backpack'])
+    data['healed'] = list(data['healed'])
+    return data
+
+def measure(factory, states):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = [factory(data) for data in states]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    del built
+    return used / len(states)
+
+# Both of these get containers of their own, like they would when loaded
+
+def legacy(data):
+    return LegacyParticipant(**{**data, 'backpack': dict(data['backpack']), 'healed': list(data['healed'])})
+
+def compact(data):
+    self = virus.Participant.__new__(virus.Participant)
+    for name, value in data.items():
+        object.__setattr__(self, name, value)
+    object.__setattr__(self, 'backpack', dict(data['backpack']) if data['backpack'] else virus.EMPTY_BACKPACK)
+    object.__setattr__(self, 'healed', list(data['healed']) if data['healed'] else virus.EMPTY_HEALED)
+    return self
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100_000)
+    args = parser.parse_args()
+
+    synthetic = [fields_of(p) for p in synthetic_state(args.users)['participants'].values()]
+    untouched = [fields_of(virus.Participant(member_id=10 ** 17 + i, immunocompromised=False)) for i in range(args.users)]
+
+    print(f'{"participants":<12} {"legacy":>10} {"slotted":>10} {"saved":>7}')
+    for label, states in (('synthetic', synthetic), ('untouched', untouched)):
+        before = measure(legacy, states)
+        after = measure(compact, states)
+        print(f'{label:<12} {before:>9.0f}B {after:>9.0f}B {1 - after / before:>7.1%}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""Drives the virus cog offline with a fake guild.
+
+Nothing here talks to Discord. A synthetic stream of messages from fake
+members is fed through EventBot.on_message as fast as possible (or at a
+fixed rate) and the throughput, per message latency and storage activity
+are reported. The latency runs until a message has been processed, for
+regular messages that includes the time spent waiting in their channel's
+queue. Some of the messages are item commands so the command path gets
+exercised as well.
+
+Run it from the repository root:
+
+    python -m benchmarks.simulate --users 5000 --channels 20 --messages 50000
+    python -m benchmarks.simulate --rate 200 --commands 0.05
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from collections import Counter
+
+import discord
+
+try:
+    import config
+except ModuleNotFoundError:
+    # The bot only needs this for the token, which is never used offline
+    sys.modules['config'] = types.ModuleType('config')
+
+from bot import EventBot
+from cogs import virus
+from cogs.data import items
+from cogs.utils import context
+
+BOT_ID = 1
+# Items that do something without asking the user for more input and without ending the event
+SIMPLE_ITEMS = (
+    items.Emoji.mask, items.Emoji.bed, items.Emoji.soap, items.Emoji.handsanitizer,
+    items.Emoji.shower, items.Emoji.pill, items.Emoji.potato, items.Emoji.herb,
+    items.Emoji.books, items.Emoji.present, items.Emoji.bell, items.Emoji.dagger,
+)
+COMMANDS = ('e!shop', 'e!shop buy {}', 'e!backpack', 'e!backpack use {}', 'e!backpack use {}')
+COMMAND_CHANNELS = (virus.TESTING_ID, virus.SNAKE_PIT_ID)
+# Messages per second the timestamps assume when running as fast as possible
+NOMINAL_RATE = 100
+
+class FakeRole:
+    def __init__(self, guild, id):
+        self.guild = guild
+        self.id = id
+
+    @property
+    def members(self):
+        return [m for m in self.guild.members.values() if self.id in m.role_ids]
+
+class FakeMember:
+    def __init__(self, guild, id, *, bot=False):
+        self.guild = guild
+        self.id = id
+        self.bot = bot
+        self.name = f'user{id}'
+        self.discriminator = f'{id % 10000:04}'
+        self.role_ids = set()
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+    def avatar_url_as(self, **kwargs):
+        return f'https://cdn.discordapp.com/embed/avatars/{self.id % 5}.png'
+
+    async def add_roles(self, *roles):
+        self.role_ids.update(role.id for role in roles)
+
+    async def remove_roles(self, *roles):
+        self.role_ids.difference_update(role.id for role in roles)
+
+    async def send(self, content=None, **kwargs):
+        self.guild.sent[None] += 1
+
+class FakeChannel:
+    def __init__(self, guild, id):
+        self.guild = guild
+        self.id = id
+        self.name = f'channel-{id}'
+
+    @property
+    def mention(self):
+        return f'<#{self.id}>'
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+    async def send(self, content=None, **kwargs):
+        self.guild.sent[self.id] += 1
+
+class FakeGuild:
+    def __init__(self, id, *, users, channels):
+        self.id = id
+        self.sent = Counter()
+        self.me = FakeMember(self, BOT_ID, bot=True)
+        self.members = {BOT_ID: self.me}
+        self.members.update((member_id, FakeMember(self, member_id)) for member_id in users)
+        self.channels = {channel_id: FakeChannel(self, channel_id) for channel_id in channels}
+        self.roles = {role_id: FakeRole(self, role_id) for role_id in (virus.INFECTED_ROLE_ID, virus.HEALER_ROLE_ID)}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, author, channel, content, created_at):
+        self.id = next(self._ids)
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.created_at = created_at
+        self.mentions = []
+        self._state = None
+        # When it was handed to the bot, see measure
+        self.received = None
+
+    async def add_reaction(self, emoji):
+        pass
+
+class SimulatedContext(context.Context):
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+class SimulatedBot(EventBot):
+    """An EventBot whose gateway and HTTP lookups are served by a fake guild."""
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.pending = []
+        self.errors = Counter()
+        super().__init__()
+
+    @property
+    def user(self):
+        return self.guild.me
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    def get_user(self, user_id):
+        return self.guild.get_member(user_id)
+
+    async def fetch_user(self, user_id):
+        return self.guild.get_member(user_id)
+
+    async def get_context(self, message, *, cls=SimulatedContext):
+        return await super().get_context(message, cls=SimulatedContext)
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        # Listeners normally run in the background, keep track of them so they count towards the latency
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        self.pending.append(task)
+        return task
+
+    async def on_error(self, event_method, *args, **kwargs):
+        self.errors[event_method] += 1
+        await super().on_error(event_method, *args, **kwargs)
+
+    async def on_command_error(self, ctx, error):
+        self.errors[type(error).__name__] += 1
+        await super().on_command_error(ctx, error)
+
+def instrument(storage, counter):
+    def wrap(name):
+        original = getattr(storage, name)
+        def wrapped(*args, **kwargs):
+            counter[name] += 1
+            return original(*args, **kwargs)
+        setattr(storage, name, wrapped)
+
+    wrap('save')
+    wrap('_write')
+
+def measure(cog, latencies):
+    # Regular messages are only queued by on_message, they're done once the batch they're in is
+    original = cog.process_messages
+    async def process_messages(messages, **kwargs):
+        try:
+            return await original(messages, **kwargs)
+        finally:
+            done = time.perf_counter()
+            latencies.extend(done - message.received for message in messages)
+    cog.process_messages = process_messages
+
+def seed_participants(cog, users, rng, *, infected, healers):
+    stats = cog.storage['stats']
+    sick = rng.sample(users, int(len(users) * infected))
+    for p in cog.register_participants(sick):
+        p.infect()
+        p.sickness = rng.randrange(1, 60)
+        cog.get_member(p.member_id).role_ids.add(virus.INFECTED_ROLE_ID)
+    stats.infected += len(sick)
+
+    candidates = list(set(users).difference(sick))
+    chosen = rng.sample(candidates, min(len(candidates), int(len(users) * healers)))
+    for p in cog.register_participants(chosen, healer=True):
+        cog.get_member(p.member_id).role_ids.add(virus.HEALER_ROLE_ID)
+    stats.healers += len(chosen)
+
+    # Give some people something to use
+    candidates = list(set(candidates).difference(chosen))
+    for p in cog.register_participants(rng.sample(candidates, len(candidates) // 10)):
+        p.mark_dirty()
+        for emoji in rng.sample(SIMPLE_ITEMS, 3):
+            p.backpack[emoji] = 3
+
+def generate_messages(guild, rng, *, count, commands, repeat, rate):
+    authors = [m for m in guild.members.values() if not m.bot]
+    channels = list(guild.channels.values())
+    command_channels = [guild.get_channel(channel_id) for channel_id in COMMAND_CHANNELS]
+    # Timestamps follow the nominal rate rather than the clock so the same seed gives the same messages
+    now = datetime.datetime.utcnow()
+    previous = None
+    for index in range(count):
+        created_at = now + datetime.timedelta(seconds=index / rate)
+        if rng.random() < commands:
+            content = rng.choice(COMMANDS).format(rng.choice(SIMPLE_ITEMS))
+            yield FakeMessage(rng.choice(authors), rng.choice(command_channels), content, created_at)
+        elif previous is not None and rng.random() < repeat:
+            # Spamming the same channel
+            yield FakeMessage(previous.author, previous.channel, 'hello', created_at)
+        else:
+            previous = FakeMessage(rng.choice(authors), rng.choice(channels), 'hello', created_at)
+            yield previous
+
+def state_digest(participants):
+    # Timestamps come from the clock so they're left out, everything else should replay exactly
+    digest = hashlib.sha256()
+    for key in sorted(participants):
+        p = participants[key]
+        digest.update(repr((key, p.infected, p.healer, p.masked, p.immunocompromised, p.sickness,
+                            sorted(p.backpack.items()))).encode())
+    return digest.hexdigest()[:16]
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def simulate(args):
+    rng = random.Random(args.seed)
+    users = rng.sample(range(10 ** 17, 10 ** 18), args.users)
+    channels = {virus.GENERAL_ID, virus.EVENT_ID, *COMMAND_CHANNELS}
+    while len(channels) < args.channels + 1:
+        channels.add(rng.randrange(10 ** 17, 10 ** 18))
+
+    guild = FakeGuild(virus.DISCORD_PY, users=users, channels=channels)
+    bot = SimulatedBot(guild)
+    cog = bot.get_cog('Virus')
+    # Without a window batches are only cut by size and by the flushes below, so a run replays exactly
+    cog.ingest_window = args.window
+    # The same seed and arguments play out exactly the same
+    await cog.reseed(args.seed)
+    seed_participants(cog, users, rng, infected=args.infected, healers=args.healers)
+    await cog.storage.flush()
+
+    writes = Counter()
+    instrument(cog.storage, writes)
+    latencies = []
+    measure(cog, latencies)
+    messages = generate_messages(guild, rng, count=args.messages, commands=args.commands, repeat=args.repeat,
+                                 rate=args.rate or NOMINAL_RATE)
+    count = 0
+    started = time.perf_counter()
+    for index, message in enumerate(messages):
+        if args.rate:
+            await asyncio.sleep(max(0.0, started + index / args.rate - time.perf_counter()))
+
+        count += 1
+        start = message.received = time.perf_counter()
+        if message.content.startswith('e!'):
+            # Regular messages are processed in batches, commands have to see everything sent before them
+            # for the run to be reproducible
+            await cog.flush_messages()
+        await bot.on_message(message)
+        while bot.pending:
+            pending, bot.pending = bot.pending, []
+            await asyncio.gather(*pending)
+        if message.content.startswith('e!'):
+            latencies.append(time.perf_counter() - start)
+
+    await cog.flush_messages()
+    elapsed = time.perf_counter() - started
+    workers = cog._workers.values()
+    # Closing the bot unloads the cog, which closes its database
+    stats = cog.storage['stats']
+    digest = state_digest(cog.storage['participants'])
+    await bot.close()
+
+    latencies.sort()
+    print(f'{count} messages from {args.users} users in {args.channels} channels in {elapsed:.2f}s')
+    print(f'throughput: {count / elapsed:.1f} messages/s')
+    print('latency:', ' '.join(
+        f'{name}={percentile(latencies, fraction) * 1000:.3f}ms'
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+    ))
+    print(f'storage: {writes["save"]} saves ({writes["save"] / count:.3f}/message), '
+          f'{writes["_write"]} writes ({writes["_write"] / count:.4f}/message)')
+    print(f'queues: {sum(w.batches for w in workers)} batches, '
+          f'{max(w.peak for w in workers)}/{virus.CHANNEL_QUEUE_SIZE} peak depth, '
+          f'{sum(w.folded for w in workers)} messages folded into bursts')
+    print(f'sent: {sum(guild.sent.values())} messages, stats: {stats}')
+    print(f'state: {digest} (seed {args.seed})')
+    if bot.errors:
+        print('errors:', ', '.join(f'{name}={n}' for name, n in bot.errors.most_common()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--rate', type=float, default=0.0, help='messages per second, 0 for as fast as possible')
+    parser.add_argument('--window', type=float, help='seconds regular messages are batched for, '
+                        'by default only full queues and commands cut batches so runs are reproducible')
+    parser.add_argument('--repeat', type=float, default=0.0,
+                        help='chance of a message being spam from the previous author in the same channel')
+    parser.add_argument('--commands', type=float, default=0.02, help='fraction of messages that are commands')
+    parser.add_argument('--infected', type=float, default=0.1, help='fraction of users initially infected')
+    parser.add_argument('--healers', type=float, default=0.02, help='fraction of users initially healers')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The cog keeps its database in the current directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            asyncio.run(simulate(args))
+        finally:
+            os.chdir(cwd)
+
+if __name__ == '__main__':
+    main()
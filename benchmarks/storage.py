@@ -0,0 +1,210 @@
+"""Benchmarks the persistence path of the virus cog.
+
+Generates synthetic event states and measures how long it takes to save
+and load them with each storage backend, along with peak memory and the
+number of bytes written.
+
+Run it from the repository root:
+
+    python -m benchmarks.storage --sizes 1000 10000
+    python -m benchmarks.storage --save-baseline
+    python -m benchmarks.storage --compare
+"""
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import os
+import pathlib
+import random
+import tempfile
+import time
+import tracemalloc
+
+from cogs import virus
+from cogs.data import items
+from cogs.utils import storage
+
+BASELINE = pathlib.Path(__file__).with_name('baseline.json')
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+BACKENDS = ('json', 'journal', 'sqlite')
+# The fraction of participants touched between saves for the incremental case
+CHURN = 0.01
+
+def synthetic_participant(member_id, rng, now):
+    p = virus.Participant(member_id=member_id, immunocompromised=rng.random() < 0.15)
+    roll = rng.random()
+    if roll < 0.3:
+        p.infect()
+        p.infected_since = now - datetime.timedelta(seconds=rng.randrange(86400 * 14))
+        p.sickness = rng.randrange(1, 100)
+    elif roll < 0.35:
+        p.healer = True
+        p.healed = [rng.randrange(10 ** 17, 10 ** 18) for _ in range(rng.randrange(4))]
+        p.last_heal = now - datetime.timedelta(seconds=rng.randrange(86400))
+
+    if rng.random() < 0.05:
+        p.kill()
+        p.death = now - datetime.timedelta(seconds=rng.randrange(86400 * 7))
+
+    # Most people never buy anything
+    if rng.random() < 0.2:
+        p.mark_dirty()
+        for data in rng.sample(items.raw, rng.randrange(1, 6)):
+            p.backpack[data['emoji']] = rng.randrange(data.get('uses', 1) + 1)
+
+    if rng.random() < 0.1:
+        p.immune_until = now + datetime.timedelta(hours=rng.randrange(1, 5))
+    if rng.random() < 0.1:
+        p.pda_cooldown = now + datetime.timedelta(minutes=rng.randrange(1, 60))
+    return p
+
+def synthetic_state(size, seed=0):
+    rng = random.Random(seed)
+    now = datetime.datetime(2020, 2, 14)
+    return {
+        'participants': {
+            member_id: synthetic_participant(member_id, rng, now)
+            for member_id in rng.sample(range(10 ** 17, 10 ** 18), size)
+        },
+        'stats': virus.Stats(infected=size // 3, healers=size // 20, dead=size // 20),
+        'store': [virus.Item(**data) for data in items.raw],
+        'next_cycle': now + datetime.timedelta(days=1),
+        'event_started': now - datetime.timedelta(days=7),
+    }
+
+def open_storage(backend, init=None):
+    # These are relative to the current directory, which is a temporary one while benchmarking
+    if backend == 'sqlite':
+        return storage.SQLiteStorage('virus.db', hook=virus.VirusStorageHook, init=init,
+                                     lazy=('participants',), cache_size=virus.PARTICIPANT_CACHE_SIZE)
+    return storage.Storage('virus.json', hook=virus.VirusStorageHook, init=init, journal=backend == 'journal')
+
+def bytes_written():
+    # Linux keeps track of this for us, otherwise the best we can do is look at the files
+    try:
+        with open('/proc/self/io') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('wchar:'))
+    except OSError:
+        return sum(path.stat().st_size for path in pathlib.Path().iterdir())
+
+def churn(db, rng):
+    participants = db['participants']
+    for member_id in rng.sample(list(participants), max(1, int(len(participants) * CHURN))):
+        participant = participants[member_id]
+        participant.sickness = min(participant.sickness + rng.randrange(1, 10), 99)
+
+def measure(func):
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+def peak_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def close(db):
+    if isinstance(db, storage.SQLiteStorage):
+        db.close()
+
+def bench_backend(backend, size):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            return measure_backend(backend, size)
+        finally:
+            os.chdir(cwd)
+
+def measure_backend(backend, size):
+    state = synthetic_state(size)
+    result = {}
+    before = bytes_written()
+    if backend == 'sqlite':
+        # This one writes everything up front when the database is empty
+        result['full_save'], db = measure(lambda: open_storage(backend, init=lambda: state))
+    else:
+        db = open_storage(backend, init=lambda: state)
+        db._dirty = True
+        result['full_save'], _ = measure(db.flush_sync)
+    result['full_bytes'] = bytes_written() - before
+
+    churn(db, random.Random(size))
+    before = bytes_written()
+    db._dirty = True
+    result['incremental_save'], _ = measure(db.flush_sync)
+    result['incremental_bytes'] = bytes_written() - before
+    close(db)
+    del db, state
+
+    result['load'], db = measure(lambda: open_storage(backend))
+    close(db)
+    del db
+
+    result['load_peak_memory'] = peak_memory(lambda: close(open_storage(backend)))
+    return result
+
+def bench_records(size):
+    state = synthetic_state(min(size, 100_000))
+    participants = list(state['participants'].values())
+    encoded = [json.loads(json.dumps(p, cls=virus.VirusStorageHook)) for p in participants]
+
+    elapsed, _ = measure(lambda: [p.to_json() for p in participants])
+    to_json = elapsed / len(participants)
+    elapsed, _ = measure(lambda: [virus.VirusStorageHook.from_json(dict(o)) for o in encoded])
+    from_json = elapsed / len(encoded)
+    return {'to_json': to_json, 'from_json': from_json}
+
+async def run(sizes, backends):
+    results = {}
+    for size in sizes:
+        results[str(size)] = entry = {'records': bench_records(size)}
+        for backend in backends:
+            entry[backend] = bench_backend(backend, size)
+            print(f'{size:>9} {backend:<8}', ' '.join(f'{k}={format_value(k, v)}' for k, v in entry[backend].items()))
+        print(f'{size:>9} records ', ' '.join(f'{k}={v * 1e6:.2f}us' for k, v in entry['records'].items()))
+    return results
+
+def format_value(key, value):
+    if key.endswith('bytes') or key.endswith('memory'):
+        return f'{value / 1024:.1f}KiB'
+    return f'{value * 1000:.1f}ms'
+
+def compare(results, baseline):
+    for size, entry in results.items():
+        for backend, metrics in entry.items():
+            for key, value in metrics.items():
+                try:
+                    old = baseline[size][backend][key]
+                except KeyError:
+                    continue
+                if old:
+                    print(f'{size:>9} {backend:<8} {key:<18} {value / old:>6.2f}x')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--output', type=pathlib.Path, help='where to write the results as JSON')
+    parser.add_argument('--save-baseline', action='store_true', help=f'write the results to {BASELINE.name}')
+    parser.add_argument('--compare', action='store_true', help=f'compare the results against {BASELINE.name}')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.sizes, args.backends))
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        BASELINE.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, json.loads(BASELINE.read_text()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""Monte Carlo sweeps over the balancing knobs of the virus event.
+
+Every run plays out an entire event with the real Participant and Item
+logic and the cog's own methods for the rules, just without Discord. A day
+consists of chatter in a few channels, healers doing their rounds, people
+buying and using items and finally the daily sickness tick. The event is
+over once enough people are vaccinated or nobody is sick anymore.
+
+Each combination of parameters is run with a number of seeds spread over
+a process pool and the distribution of the outcomes is reported.
+
+Run it from the repository root:
+
+    python -m benchmarks.sweep --runs 200
+    python -m benchmarks.sweep --param infection_cutoff=500,1000,2000 --param max_heals=2,3,5
+"""
+
+import argparse
+import concurrent.futures
+import dataclasses
+import datetime
+import itertools
+import json
+import os
+import pathlib
+import random
+import time
+import types
+
+from cogs import virus
+from cogs.data import items
+
+# name -> (module attribute, type, default values to sweep)
+PARAMETERS = {
+    'max_vaccine': ('MAX_VACCINE', int, (virus.MAX_VACCINE,)),
+    'max_heals': ('MAX_ALLOWED_HEALS', int, (virus.MAX_ALLOWED_HEALS,)),
+    'infection_cutoff': ('INFECTION_CUTOFF', float, (virus.INFECTION_CUTOFF,)),
+    'immunocompromised': ('IMMUNOCOMPROMISED_RATE', float, (virus.IMMUNOCOMPROMISED_RATE,)),
+    'mask_effectiveness': ('MASK_EFFECTIVENESS', float, (virus.MASK_EFFECTIVENESS,)),
+    'surround_healing': ('SURROUND_HEALING_CHANCE', float, (virus.SURROUND_HEALING_CHANCE,)),
+    'room_size': ('ROOM_SIZE', int, (virus.ROOM_SIZE,)),
+}
+
+@dataclasses.dataclass
+class Scenario:
+    population: int = 2000
+    channels: int = 10
+    messages: int = 5000
+    item_uses: int = 50
+    initial_infected: int = 15
+    initial_healers: int = 6
+    max_days: int = 60
+
+@dataclasses.dataclass
+class Outcome:
+    eradicated: bool
+    days: int
+    peak_infected: int
+    deaths: int
+    vaccinated: int
+
+class Context:
+    """The bits of commands.Context that item code reaches for."""
+
+    def __init__(self, cog):
+        self.cog = cog
+
+    async def silent_react(self, emoji):
+        pass
+
+class Member:
+    """Stands in for the discord.Member of whoever used an item."""
+
+    async def add_roles(self, *roles):
+        pass
+
+    async def remove_roles(self, *roles):
+        pass
+
+class Channel:
+    async def send(self, content=None, **kwargs):
+        pass
+
+class Storage:
+    """Just enough of Storage for the cog's rules, nothing is ever written."""
+
+    def __init__(self, **entries):
+        self._db = entries
+
+    def __getitem__(self, key):
+        return self._db[key]
+
+    async def save(self):
+        pass
+
+class Event:
+    """Stands in for the Virus cog. The rules are the cog's own methods, only the I/O is left out."""
+
+    # These are used as-is so the sweep plays by exactly the same rules as the bot
+    is_over = virus.Virus.is_over
+    infect = virus.Virus.infect
+    reinfect = virus.Virus.reinfect
+    kill = virus.Virus.kill
+    cure = virus.Virus.cure
+    vaccinate = virus.Virus.vaccinate
+    process_state = virus.Virus.process_state
+    surround_healing = virus.Virus.surround_healing
+    _process_message = virus.Virus._process_message
+    _add_sickness = virus.Virus._add_sickness
+
+    def __init__(self, scenario, rng):
+        self.scenario = scenario
+        self.rng = rng
+        self.stats = virus.Stats()
+        self.storage = Storage(stats=self.stats)
+        self.log_channel = Channel()
+        self.member = Member()
+        self.participants = [virus.Participant(member_id=member_id) for member_id in range(scenario.population)]
+        self.store = [virus.Item(**data) for data in items.raw if 'ctx.request' not in data['code']]
+        for item in self.store:
+            item.unlocked = True
+
+        self._authors = [virus.Room(maxlen=virus.ROOM_SIZE) for _ in range(scenario.channels)]
+        self.ctx = Context(self)
+        # The time of day in the event, messages are spread evenly over a day
+        self.clock = datetime.datetime.utcnow()
+
+        chosen = rng.sample(self.participants, scenario.initial_infected + scenario.initial_healers)
+        for p in chosen[:scenario.initial_infected]:
+            self.stats.infected += p.infect()
+        for p in chosen[scenario.initial_infected:]:
+            p.healer = True
+            self.stats.healers += 1
+
+    def infectious(self):
+        return sum(1 for p in self.participants if p.is_infectious())
+
+    # What the cog's methods expect to be there besides the above
+
+    def get_member(self, member_id):
+        return None
+
+    async def get_participant(self, member_id):
+        return self.participants[member_id]
+
+    async def send_message(self, participant):
+        pass
+
+    send_infect_message = send_reinfect_message = send_dead_message = send_message
+    send_cured_message = send_healer_message = send_healer_remove_message = send_message
+
+    # A day of the event
+
+    def chatter(self):
+        rng = self.rng
+        alive = [p for p in self.participants if not p.is_dead()]
+        step = datetime.timedelta(days=1) / self.scenario.messages
+        dead = []
+        for index in range(self.scenario.messages):
+            if self.is_over():
+                break
+
+            user = rng.choice(alive)
+            message = types.SimpleNamespace(
+                author=types.SimpleNamespace(id=user.member_id),
+                channel=types.SimpleNamespace(id=rng.randrange(len(self._authors))),
+                created_at=self.clock + step * index,
+            )
+            run(self._process_message(message, 1, [], dead))
+
+        # The same as the end of Virus.process_messages
+        self.stats.dead += sum(user.kill() for user in dead)
+        self.clock += datetime.timedelta(days=1)
+
+    def heal(self):
+        # What Virus.expire does once these are over
+        for p in self.participants:
+            if p.immune_until is not None and p.immune_until < self.clock:
+                p.immune_until = None
+
+        patients = [p for p in self.participants if p.is_infectious() and not p.healer]
+        # Participant.heal goes by the wall clock, the immunity it gives is moved over to the event's
+        offset = self.clock - datetime.datetime.utcnow()
+        for healer in self.participants:
+            if not healer.healer or healer.is_dead():
+                continue
+
+            # Healing is limited per day so reset what happened the day before
+            healer.healed = []
+            for other in self.rng.sample(patients, min(len(patients), virus.MAX_ALLOWED_HEALS)):
+                try:
+                    state = healer.heal(other)
+                except virus.VirusError:
+                    continue
+                other.immune_until += offset
+                run(self.process_state(state, other, cause=healer))
+
+    def use_items(self):
+        rng = self.rng
+        for item in self.store:
+            item.in_stock = item.total
+
+        for _ in range(self.scenario.item_uses):
+            if self.is_over():
+                return
+
+            user = rng.choice(self.participants)
+            buyable = [item for item in self.store if item.is_buyable_for(user)]
+            if not buyable:
+                continue
+
+            item = rng.choice(buyable)
+            user.buy(item)
+            if user.backpack[item.emoji] and item.usable_by(user):
+                state = run(user.use(self.ctx, item))
+                if state is not None and state is not virus.State.already_dead:
+                    run(self.process_state(state, user, member=self.member))
+
+    def tick(self):
+        for user in virus.progress_sickness(self.participants, 15):
+            run(self.kill(user))
+
+    def play(self):
+        peak = infectious = self.infectious()
+        day = 0
+        while day < self.scenario.max_days and infectious and not self.is_over():
+            day += 1
+            self.chatter()
+            self.heal()
+            self.use_items()
+            self.tick()
+            infectious = self.infectious()
+            peak = max(peak, infectious)
+
+        return Outcome(
+            eradicated=self.is_over() or infectious == 0,
+            days=day,
+            peak_infected=peak,
+            deaths=self.stats.dead,
+            vaccinated=self.stats.vaccinated,
+        )
+
+def run(coro):
+    # None of the coroutines here ever suspend so an event loop isn't needed
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError('coroutine suspended')
+
+def simulate(job):
+    params, scenario, seed = job
+    for name, value in params.items():
+        setattr(virus, PARAMETERS[name][0], value)
+
+    virus.streams.reseed(seed)
+    return Event(scenario, random.Random(seed)).play()
+
+def parse_param(text):
+    name, _, values = text.partition('=')
+    try:
+        _, converter, _ = PARAMETERS[name]
+    except KeyError:
+        raise argparse.ArgumentTypeError(f'unknown parameter {name!r}, expected one of {", ".join(PARAMETERS)}')
+    return name, tuple(converter(value) for value in values.split(','))
+
+def grid(overrides):
+    values = {name: default for name, (_, _, default) in PARAMETERS.items()}
+    values.update(overrides)
+    names = list(values)
+    for combination in itertools.product(*values.values()):
+        yield dict(zip(names, combination))
+
+def percentile(ordered, fraction):
+    # Interpolates between the closest ranks, the same as statistics.quantiles(method='inclusive') on 3.8+
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def quantiles(values):
+    if len(values) < 2:
+        return values * 3
+    ordered = sorted(values)
+    return [percentile(ordered, 0.1), percentile(ordered, 0.5), percentile(ordered, 0.9)]
+
+def summarise(outcomes):
+    eradicated = [o for o in outcomes if o.eradicated]
+    return {
+        'runs': len(outcomes),
+        'eradicated': len(eradicated) / len(outcomes),
+        'days': quantiles([o.days for o in eradicated]),
+        'peak_infected': quantiles([o.peak_infected for o in outcomes]),
+        'deaths': quantiles([o.deaths for o in outcomes]),
+    }
+
+def format_summary(summary):
+    def spread(values):
+        return '/'.join(f'{v:g}' for v in values) if values else '-'
+
+    return (f'eradicated={summary["eradicated"]:.0%} days={spread(summary["days"])} '
+            f'peak={spread(summary["peak_infected"])} deaths={spread(summary["deaths"])}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--param', type=parse_param, action='append', default=[], metavar='NAME=V1,V2,...',
+                        help=f'values to sweep, one of: {", ".join(PARAMETERS)}')
+    parser.add_argument('--runs', type=int, default=100, help='runs per parameter combination')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=pathlib.Path, help='where to write the results as JSON')
+    for field in dataclasses.fields(Scenario):
+        parser.add_argument(f'--{field.name.replace("_", "-")}', type=int, default=field.default)
+    args = parser.parse_args()
+
+    scenario = Scenario(**{field.name: getattr(args, field.name) for field in dataclasses.fields(Scenario)})
+    combinations = list(grid(dict(args.param)))
+    jobs = [
+        (params, scenario, args.seed + run)
+        for params in combinations
+        for run in range(args.runs)
+    ]
+
+    print(f'{len(combinations)} combinations, {len(jobs)} runs on {args.workers} workers')
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        outcomes = list(executor.map(simulate, jobs, chunksize=max(1, len(jobs) // (args.workers * 8))))
+
+    results = []
+    swept = [name for name, _ in args.param]
+    for index, params in enumerate(combinations):
+        summary = summarise(outcomes[index * args.runs:(index + 1) * args.runs])
+        results.append({'params': params, **summary})
+        label = ' '.join(f'{name}={params[name]:g}' for name in swept) or 'defaults'
+        print(f'{label}: {format_summary(summary)}')
+
+    print(f'done in {time.perf_counter() - start:.1f}s (p10/p50/p90)')
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,15 @@ class EventBot(commands.Bot):
     def run(self):
         super().run(config.token)
 
+    async def close(self):
+        # Some cogs defer their writes so make sure they hit the disk
+        for cog in self.cogs.values():
+            storage = getattr(cog, 'storage', None)
+            if storage is not None:
+                await storage.flush()
+
+        await super().close()
+
     async def on_ready(self):
         if self.uptime is None:
             self.uptime = datetime.datetime.utcnow()
@@ -70,7 +70,7 @@ raw = [
         'uses': 3,
         'code': dedent("""
             if user.infected:
-                user.sickness = max(user.sickness - random.randint(10, 15), 5)
+                user.sickness = max(user.sickness - user.rng.randint(10, 15), 5)
         """)
     },
     {
@@ -136,7 +136,7 @@ raw = [
         'code': dedent("""
             if user.infected:
                 if user.sickness >= 30:
-                    user.sickness -= random.randint(8, 16)
+                    user.sickness -= user.rng.randint(8, 16)
                 elif user.sickness >= 10:
                     user.sickness = max(user.sickness - 3, 10)
         """),
@@ -147,11 +147,11 @@ raw = [
         'description': 'Experimental medicine that might help',
         'total': 10,
         'code': dedent("""
-            roll = random.random()
+            roll = user.rng.random()
             if roll < 0.1:
                 user.sickness = 0
                 return State.cured
-            return user.add_sickness(random.randint(-20, -5))
+            return user.add_sickness(user.rng.randint(-20, -5))
         """),
         'predicate': 'return user.is_infectious()',
     },
@@ -171,7 +171,7 @@ raw = [
         'total': 20,
         'uses': 5,
         'description': 'Who needs western medicine?',
-        'code': 'return user.add_sickness(random.randint(-2, 2))',
+        'code': 'return user.add_sickness(user.rng.randint(-2, 2))',
         'predicate': 'return user.is_infectious()',
     },
     {
@@ -180,7 +180,7 @@ raw = [
         'description': 'The most important thing in a society',
         'total': 100,
         'code': dedent("""
-            roll = random.random()
+            roll = user.rng.random()
             if roll < 0.05:
                 user.healer = True
                 return State.become_healer
@@ -203,9 +203,10 @@ raw = [
                 raise VirusError("Uh, you probably want to send that to someone else.")
 
             participant = await ctx.cog.get_participant(member.id)
+            participant.mark_dirty()
             participant.backpack['{Emoji.love_letter}'] = 1
-            chances = [(10, 'infect'), (89, 'nothing'), (1, 'kill')]
-            value = weighted_random(chances)
+            chances = ((10, 'infect'), (89, 'nothing'), (1, 'kill'))
+            value = weighted_random(chances, user.rng)
             if value == 'infect':
                 await ctx.cog.reinfect(participant)
             elif value == 'kill':
@@ -221,18 +222,18 @@ raw = [
         'total': 100,
         'code': dedent("""
             if user.is_susceptible():
-                roll = random.random()
+                roll = user.rng.random()
                 if roll < 0.25:
                     await ctx.cog.infect(user)
             elif user.infected:
-                roll = weighted_random([(1, 'a'), (3, 'b'), (6, 'c')])
+                roll = weighted_random(((1, 'a'), (3, 'b'), (6, 'c')), user.rng)
                 if roll == 'a':
                     await ctx.silent_react('\N{COLLISION SYMBOL}')
                     return State.dead
                 elif roll == 'b':
                     return user.add_sickness(-10)
                 else:
-                    return user.add_sickness(random.randint(10, 20))
+                    return user.add_sickness(user.rng.randint(10, 20))
         """)
     },
     {
@@ -249,13 +250,13 @@ raw = [
 
             if user.healer:
                 # Healers have a higher chance of healing
-                rates = [(20, -20), (65, -5), (5, 20), (10, 15)]
+                rates = ((20, -20), (65, -5), (5, 20), (10, 15))
             elif user.infected:
-                rates = [(65, 20), (5, -5), (20, 10), (10, 15)]
+                rates = ((65, 20), (5, -5), (20, 10), (10, 15))
             else:
-                rates = [(90, 0), (5, -5), (5, 5)]
+                rates = ((90, 0), (5, -5), (5, 5))
 
-            sickness = weighted_random(rates)
+            sickness = weighted_random(rates, user.rng)
             await ctx.cog.apply_sickness_to_all(channel, sickness, cause=user)
         """)
     },
@@ -265,8 +266,8 @@ raw = [
         'description': "Probably not a good idea to touch this one...",
         'total': 25,
         'code': dedent("""
-            rates = [(75, 'infect'), (2, 'cure'), (3, 'die'), (20, 'healer')]
-            roll = weighted_random(rates)
+            rates = ((75, 'infect'), (2, 'cure'), (3, 'die'), (20, 'healer'))
+            roll = weighted_random(rates, user.rng)
             if roll == 'infect':
                 await ctx.cog.reinfect(user)
             elif roll == 'cure':
@@ -294,12 +295,12 @@ raw = [
             if participant.death is not None:
                 raise VirusError("It's rude to play with the dead.")
 
-            chance = [(1, 'die'), (5, 'dud')]
-            if weighted_random(chance) == 'die':
+            chance = ((1, 'die'), (5, 'dud'))
+            if weighted_random(chance, user.rng) == 'die':
                 return await ctx.cog.process_state(State.dead, participant, cause=user)
 
             if participant.is_cured():
-                if random.randint(0, 5) == 5:
+                if user.rng.randint(0, 5) == 5:
                     await ctx.cog.process_state(State.reinfect, participant, cause=user)
                 return
 
@@ -308,9 +309,9 @@ raw = [
                 return
 
             if user.infected:
-                sickness = random.randint(5, 20)
+                sickness = user.rng.randint(5, 20)
             else:
-                sickness = random.randint(-10, 10)
+                sickness = user.rng.randint(-10, 10)
 
             state = participant.add_sickness(sickness)
             await ctx.cog.process_state(state, participant, cause=user)
@@ -324,14 +325,14 @@ raw = [
         'uses': 2,
         'code': dedent("""
             if user.is_infectious():
-                return user.add_sickness(random.randint(10, 50))
+                return user.add_sickness(user.rng.randint(10, 50))
 
             if user.is_susceptible():
-                if random.randint(0, 1) == 0:
+                if user.rng.randint(0, 1) == 0:
                     await ctx.cog.infect(user)
 
             if user.healer:
-                if random.randint(0, 1) == 0:
+                if user.rng.randint(0, 1) == 0:
                     return State.lose_healer
         """)
     }
@@ -0,0 +1,112 @@
+import hashlib
+import random
+import secrets
+import struct
+
+# 2 ** -53, random floats have 53 bits of precision
+_FLOAT_SCALE = 1.0 / 9007199254740992
+_BLOCK = struct.Struct('<8Q')
+
+class Stream:
+    """A reproducible stream of random numbers.
+
+    The numbers are generated in blocks by hashing the block number with the
+    stream's key, so a stream is cheap to create and only has to remember how
+    far along it is. This implements the subset of :class:`random.Random`
+    that's actually used.
+
+    Every draw costs a lot more than one from :class:`random.Random`, these
+    are meant for the occasional roll rather than for hot paths.
+    """
+
+    __slots__ = ('_key', '_block', '_buffer', 'generation')
+
+    def __init__(self, key, block=0, generation=0):
+        self._key = key
+        self._block = block
+        self._buffer = []
+        # Which seeding of Streams this came from, see Streams.participant
+        self.generation = generation
+
+    def _refill(self):
+        digest = hashlib.blake2b(self._block.to_bytes(8, 'little'), key=self._key).digest()
+        self._block += 1
+        # Consumed from the end
+        self._buffer.extend(reversed(_BLOCK.unpack(digest)))
+
+    def _next(self):
+        if not self._buffer:
+            self._refill()
+        return self._buffer.pop()
+
+    def _below(self, n):
+        if n <= 0:
+            raise ValueError('empty range')
+
+        # Rejection sampling so there's no modulo bias
+        shift = 64 - (n - 1).bit_length()
+        while True:
+            value = self._next() >> shift
+            if value < n:
+                return value
+
+    def random(self):
+        return (self._next() >> 11) * _FLOAT_SCALE
+
+    def randrange(self, start, stop=None):
+        if stop is None:
+            return self._below(start)
+        return start + self._below(stop - start)
+
+    def randint(self, a, b):
+        return a + self._below(b - a + 1)
+
+    def choice(self, seq):
+        return seq[self._below(len(seq))]
+
+class Streams:
+    """Random numbers derived from a single seed.
+
+    Hot paths draw from :attr:`event`, a plain :class:`random.Random`.
+    Participants get a :class:`Stream` of their own for everything else.
+    The same seed, boot and input replay the exact same outcome.
+
+    ``boot`` is mixed into everything as well so that a restart, which
+    starts every stream over, doesn't replay the draws of the one before.
+    """
+
+    def __init__(self, seed=None, boot=0):
+        self.generation = 0
+        self.reseed(seed, boot)
+
+    def reseed(self, seed=None, boot=0):
+        self.seed = secrets.randbits(63) if seed is None else seed
+        self.boot = boot
+        self.event = random.Random(int.from_bytes(self._key('event'), 'little'))
+        # Streams from before this are stale, holders can compare their generation to this one
+        self.generation += 1
+        # How many participant streams have been handed out so far
+        self._handed_out = 0
+
+    def _key(self, *name):
+        return hashlib.blake2b(repr((self.seed, self.boot, *name)).encode(), digest_size=32).digest()
+
+    def fixed(self, *name):
+        """Returns a number in [0, 1) that only depends on the seed and ``name``.
+
+        Unlike everything else this doesn't change with the boot, it's for
+        things that have to come out the same whenever they're worked out.
+        """
+        digest = hashlib.blake2b(repr((self.seed, *name)).encode(), digest_size=8).digest()
+        return (int.from_bytes(digest, 'little') >> 11) * _FLOAT_SCALE
+
+    def participant(self, member_id):
+        """Returns a new stream for a participant.
+
+        These aren't kept around, the caller holds on to it for as long as it
+        needs. Every stream starts out at a block range of its own so one that's
+        handed out again for the same participant doesn't repeat any numbers.
+        """
+        block = self._handed_out << 32
+        self._handed_out += 1
+        return Stream(self._key('participant', int(member_id)), block, self.generation)
@@ -0,0 +1,220 @@
+import asyncio
+import dataclasses
+import datetime
+import heapq
+import sys
+import traceback
+import typing
+
+from . import storage
+
+# How long a job that isn't repeating waits before it's tried again after its handler failed.
+# This doubles with every attempt, after MAX_ATTEMPTS the job is given up on.
+RETRY_DELAY = datetime.timedelta(minutes=1)
+MAX_ATTEMPTS = 8
+
+@dataclasses.dataclass
+class Job:
+    """Something that has to happen at a certain time, possibly over and over."""
+
+    when: datetime.datetime
+    name: str
+    kind: str
+    interval: typing.Optional[datetime.timedelta] = None
+    data: typing.Dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    # Jobs that don't survive a restart, e.g. because they're set up again on start anyway
+    durable: bool = dataclasses.field(default=True, compare=False)
+    # How many times the handler of a job that isn't repeating failed so far
+    attempts: int = dataclasses.field(default=0, compare=False)
+
+    def __lt__(self, other):
+        return (self.when, self.name) < (other.when, other.name)
+
+    @classmethod
+    def from_json(cls, data):
+        data['when'] = storage.from_timestamp(data['when'])
+        if data.get('interval') is not None:
+            data['interval'] = datetime.timedelta(seconds=data['interval'])
+        return cls(**data)
+
+    def to_json(self):
+        return {
+            'when': storage.to_timestamp(self.when),
+            'name': self.name,
+            'kind': self.kind,
+            'interval': self.interval and self.interval.total_seconds(),
+            'data': self.data,
+            'attempts': self.attempts,
+        }
+
+class Scheduler:
+    """Runs jobs at their scheduled time, all from a single task.
+
+    The jobs are kept in a heap ordered by when they're due and the durable
+    ones are persisted under ``key`` in the given :class:`Storage`. Every job
+    has a unique name, scheduling one with a name that's already taken
+    replaces it so jobs don't pile up across restarts.
+
+    What a job does is up to the handler registered for its kind. Handlers
+    are called with the job and how many times it was due. Repeating jobs
+    that were missed, e.g. because the bot was down, are caught up according
+    to the handler's policy:
+
+    - ``'batch'`` calls it once for all the missed runs.
+    - ``'skip'`` calls it once as if only the last one was due.
+    - ``'each'`` calls it once for every missed run.
+
+    A job that only runs once is tried again if its handler raises, so it
+    isn't lost. It waits :data:`RETRY_DELAY` at first and twice as long
+    every time after, up to :data:`MAX_ATTEMPTS` attempts.
+    """
+
+    def __init__(self, storage, key='jobs', *, loop=None):
+        self.storage = storage
+        self.key = key
+        self.loop = loop or asyncio.get_event_loop()
+        self._handlers = {}
+        self._heap = list(storage.get(key) or ())
+        heapq.heapify(self._heap)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __contains__(self, name):
+        return any(job.name == name for job in self._heap)
+
+    def __iter__(self):
+        return iter(sorted(self._heap))
+
+    def get(self, name):
+        return next((job for job in self._heap if job.name == name), None)
+
+    def register(self, kind, handler, *, catch_up='batch'):
+        if catch_up not in ('batch', 'skip', 'each'):
+            raise ValueError(f'unknown catch up policy {catch_up!r}')
+        self._handlers[kind] = (handler, catch_up)
+
+    async def _persist(self):
+        # The heap isn't part of a transaction, so neither is what's stored of it
+        await self.storage.put(self.key, [job for job in self._heap if job.durable], rollback=False)
+
+    def _remove(self, name):
+        for index, job in enumerate(self._heap):
+            if job.name == name:
+                self._heap[index] = self._heap[-1]
+                self._heap.pop()
+                heapq.heapify(self._heap)
+                return job
+        return None
+
+    async def schedule(self, name, kind, when, *, interval=None, data=None, durable=True, replace=True):
+        """Adds a job that's due at ``when`` and then every ``interval`` if given.
+
+        If a job with this name already exists it's replaced, unless ``replace``
+        is ``False`` in which case the existing one is kept and returned.
+        """
+        existing = self.get(name)
+        if existing is not None:
+            if not replace:
+                return existing
+            self._remove(name)
+
+        job = Job(when=when, name=name, kind=kind, interval=interval, data=data or {}, durable=durable)
+        heapq.heappush(self._heap, job)
+        if durable or (existing is not None and existing.durable):
+            await self._persist()
+        self._wakeup.set()
+        return job
+
+    def schedule_nowait(self, name, kind, when, *, interval=None, data=None):
+        """Same as :meth:`schedule` for a job that isn't durable.
+
+        Nothing has to be persisted for these so this can be called from
+        anywhere, not just coroutines. It can't replace a durable job.
+        """
+        existing = self.get(name)
+        if existing is not None:
+            if existing.durable:
+                raise ValueError(f'job {name!r} is durable')
+            self._remove(name)
+
+        job = Job(when=when, name=name, kind=kind, interval=interval, data=data or {}, durable=False)
+        heapq.heappush(self._heap, job)
+        self._wakeup.set()
+        return job
+
+    async def cancel(self, name):
+        """Removes a job. Returns whether there was one."""
+        job = self._remove(name)
+        if job is None:
+            return False
+        if job.durable:
+            await self._persist()
+        self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = (self._heap[0].when - datetime.datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job = heapq.heappop(self._heap)
+            await self._run_job(job)
+
+    async def _run_job(self, job):
+        now = datetime.datetime.utcnow()
+        due = 1
+        if job.interval is not None:
+            # Every run that's been missed plus the one that's due now
+            due += int((now - job.when) / job.interval)
+            job.when += job.interval * due
+            heapq.heappush(self._heap, job)
+            # The next run is stored right away so a crash midway doesn't run this one again
+            if job.durable:
+                await self._persist()
+
+        try:
+            handler, catch_up = self._handlers[job.kind]
+        except KeyError:
+            print(f'No handler for job {job.name} of kind {job.kind}', file=sys.stderr)
+            calls = []
+        else:
+            calls = [1] * due if catch_up == 'each' else [due if catch_up == 'batch' else 1]
+
+        failed = False
+        for runs in calls:
+            try:
+                await handler(job, runs)
+            except Exception:
+                print(f'In job {job.name}:', file=sys.stderr)
+                traceback.print_exc()
+                failed = True
+
+        if job.interval is None:
+            # Jobs that only run once stay stored until they went through
+            if failed and job.name not in self:
+                job.attempts += 1
+                if job.attempts < MAX_ATTEMPTS:
+                    job.when = datetime.datetime.utcnow() + RETRY_DELAY * 2 ** (job.attempts - 1)
+                    heapq.heappush(self._heap, job)
+                else:
+                    print(f'Giving up on job {job.name} after {job.attempts} attempts', file=sys.stderr)
+            if job.durable:
+                await self._persist()
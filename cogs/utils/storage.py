@@ -1,8 +1,43 @@
 import json
 import os
+import re
 import uuid
 import asyncio
+import contextlib
+import contextvars
+import copy
+import sqlite3
+import sys
+import threading
+import traceback
 import datetime
+import dataclasses
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+# $name in SQLiteStorage.select
+_FIELD = re.compile(r'\$(\w+)')
+
+def to_timestamp(dt):
+    """Converts a naive UTC datetime into integer microseconds since the epoch."""
+    if dt is None:
+        return None
+    return (dt - EPOCH) // MICROSECOND
+
+def from_timestamp(value):
+    """The inverse of :func:`to_timestamp`.
+
+    Also accepts the older ``{'__date__': ...}`` format along with
+    already decoded datetimes so existing files keep working.
+    """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, dict):
+        return datetime.datetime.fromisoformat(value['__date__'])
+    return EPOCH + datetime.timedelta(microseconds=value)
 
 class StorageHook(json.JSONEncoder):
     def default(self, o):
@@ -24,6 +59,359 @@ class StorageHook(json.JSONEncoder):
     def from_json(cls, data):
         return data
 
+    @classmethod
+    def sub_key(cls, key, sub):
+        """Converts the key of an entry in a top-level dict from its JSON form.
+
+        JSON only has string keys. Subclasses can override this so the entries
+        of ``key`` are keyed by something else in memory, e.g. ints. This has to
+        agree with what :meth:`decode` builds for the whole dict.
+        """
+        return sub
+
+    @classmethod
+    def decode(cls, value, path=()):
+        """Converts plain decoded JSON into its in-memory form.
+
+        ``path`` is the key path of the value within the document, with
+        an empty path being the entire document. Subclasses that know the
+        layout of their data can override this to build it directly rather
+        than going through :meth:`object_hook` for every single object.
+        """
+        if type(value) is dict:
+            return cls.object_hook({key: cls.decode(v, (*path, key)) for key, v in value.items()})
+        if type(value) is list:
+            return [cls.decode(v, path) for v in value]
+        return value
+
+# The transaction the current task is in, if any
+_transaction = contextvars.ContextVar('transaction', default=None)
+
+_missing = object()
+
+class Transaction:
+    """Keeps track of what's needed to undo a :meth:`Storage.transaction`.
+
+    Only what the transaction itself wrote is undone. Other tasks can write
+    to the same records in the meantime, those records are left as they are
+    rather than throwing away somebody else's changes.
+
+    A nested transaction has a ``parent``, everything it captures is
+    captured by the parent as well so that undoing the parent still covers it.
+    """
+
+    def __init__(self, storage, parent=None):
+        self.storage = storage
+        self.parent = parent
+        self.deferred = set()
+        # id(record) -> (record, {field: value before it was first written}), or None for new records
+        self.undo = {}
+        # id(record) -> the version it had after the last write in this transaction
+        self.versions = {}
+        # (storage, key) -> (value before the first put, value put last)
+        self.keys = {}
+        self.token = None
+
+    def capture(self, record, name=None):
+        """Called right before ``record`` is modified.
+
+        ``name`` is the field being assigned to. Without one a container is
+        about to be changed in place, so every container field is kept.
+        """
+        if self.parent is not None:
+            self.parent.capture(record, name)
+
+        key = id(record)
+        try:
+            _, fields = self.undo[key]
+        except KeyError:
+            if all(n[0] == '_' for n in record._state()):
+                # This is being created right now so there's nothing to go back to
+                fields = None
+            else:
+                fields = {}
+            self.undo[key] = (record, fields)
+        else:
+            if self.versions[key] != record._version:
+                # Somebody else wrote to it since, so it can't be undone anymore
+                fields = None
+                self.undo[key] = (record, None)
+
+        self.versions[key] = record._version + 1
+        if fields is None:
+            return
+
+        if name is not None:
+            if name not in fields:
+                value = getattr(record, name, _missing)
+                fields[name] = copy.copy(value) if type(value) in (dict, list) else value
+            return
+
+        for n, value in record._state().items():
+            if n[0] != '_' and n not in fields and isinstance(value, (Mapping, list, tuple)):
+                fields[n] = copy.copy(value) if type(value) in (dict, list) else value
+
+    def capture_key(self, storage, key, value):
+        """Called right before a top-level key of ``storage`` is set to ``value``."""
+        if self.parent is not None:
+            self.parent.capture_key(storage, key, value)
+
+        try:
+            previous, _ = self.keys[storage, key]
+        except KeyError:
+            previous = storage._db.get(key, _missing)
+        self.keys[storage, key] = (previous, value)
+
+    def rollback(self):
+        for key, (record, fields) in self.undo.items():
+            if not fields or self.versions[key] != record._version:
+                continue
+            state = {name: value for name, value in fields.items() if value is not _missing}
+            # It has to be written again since the old state might've been saved in the meantime
+            state['_version'] = record._version + 1
+            record._restore(state)
+            if self.parent is not None:
+                # That wasn't somebody else writing to it as far as the parent is concerned
+                self.parent.versions[key] = record._version
+
+        for (storage, key), (previous, value) in self.keys.items():
+            if storage._db.get(key, _missing) is not value:
+                # Replaced by somebody else since
+                continue
+            if previous is _missing:
+                storage._db.pop(key, None)
+            else:
+                storage._db[key] = previous
+            if self.parent is not None:
+                before, _ = self.parent.keys[storage, key]
+                self.parent.keys[storage, key] = (before, previous)
+
+class Record:
+    """A mixin for stored objects that keeps track of modifications.
+
+    Assigning to a public attribute bumps the record's version, which lets
+    :class:`Storage` re-use the previously encoded JSON of records that
+    haven't changed since. In-place mutation of containers can't be seen
+    so :meth:`mark_dirty` has to be called right before those.
+    """
+
+    __slots__ = ('_version', '_encoded', '_on_change', '__weakref__')
+
+    # The initial values of private attributes.
+    # _encoded is the (version, encoded JSON) of the last time this was encoded.
+    # _on_change is called with the record right before it's first modified, if set.
+    _defaults = {'_version': 0, '_encoded': None, '_on_change': None}
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls)
+        for name, value in cls._defaults.items():
+            object.__setattr__(self, name, value)
+        return self
+
+    def __setattr__(self, name, value):
+        if name[0] != '_':
+            self._modified(name)
+        object.__setattr__(self, name, value)
+
+    def _modified(self, name=None):
+        transaction = _transaction.get()
+        if transaction is not None:
+            transaction.capture(self, name)
+        object.__setattr__(self, '_version', self._version + 1)
+
+        callback = self._on_change
+        if callback is not None:
+            object.__setattr__(self, '_on_change', None)
+            callback(self)
+
+    def mark_dirty(self):
+        """Call this right before modifying a container attribute in place."""
+        self._modified()
+
+    def is_dirty(self):
+        cached = self._encoded
+        return cached is None or cached[0] != self._version
+
+    _slot_names = ('_version', '_encoded', '_on_change')
+
+    def _state(self):
+        state = {}
+        for name in type(self)._slot_names:
+            try:
+                state[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        state.update(getattr(self, '__dict__', ()))
+        return state
+
+    def _restore(self, state):
+        # Used to undo a transaction, this doesn't go through __setattr__
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+def slotted(cls):
+    """Rebuilds a :class:`Record` dataclass so that it uses ``__slots__``.
+
+    Every field gets a slot, as does every name in ``_defaults``. This is
+    what ``dataclass(slots=True)`` does on Python 3.10 and later.
+    """
+    inherited = []
+    for base in reversed(cls.__mro__[1:]):
+        inherited.extend(name for name in base.__dict__.get('_slot_names', ()) if name not in inherited)
+
+    fields = tuple(field.name for field in dataclasses.fields(cls))
+    extra = tuple(name for name in cls._defaults if name not in inherited)
+    namespace = dict(cls.__dict__)
+    namespace['__slots__'] = fields + extra
+    for name in namespace['__slots__']:
+        namespace.pop(name, None)
+    namespace.pop('__dict__', None)
+    namespace.pop('__weakref__', None)
+
+    new = type(cls)(cls.__name__, cls.__bases__, namespace)
+    new.__qualname__ = cls.__qualname__
+    new._slot_names = tuple(inherited) + fields + extra
+
+    # Zero argument super() refers to the class through a closure cell, which still points to the old one
+    for value in namespace.values():
+        for func in (value, getattr(value, '__func__', None), getattr(value, 'fget', None)):
+            for cell in getattr(func, '__closure__', None) or ():
+                if cell.cell_contents is cls:
+                    cell.cell_contents = new
+    return new
+
+class PagedDict(MutableMapping):
+    """A dict of records that only keeps the most recently used ones in memory.
+
+    The rest are paged in from a :class:`SQLiteStorage` on access. Records
+    that are evicted while dirty are encoded right away and written back
+    on the next save.
+    """
+
+    def __init__(self, storage, key, cache_size):
+        self.storage = storage
+        self.key = key
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # Everything that's still referenced somewhere, e.g. by the cache.
+        # This is what keeps identity stable when something outlives its cache slot.
+        self._live = weakref.WeakValueDictionary()
+        # sub -> encoded JSON that isn't known to be on disk yet
+        self._pending = {}
+        self._deleted = set()
+        self._len = storage._count(key)
+
+    def _load(self, sub):
+        try:
+            return self._live[sub]
+        except KeyError:
+            pass
+
+        if sub in self._deleted:
+            raise KeyError(sub)
+
+        encoded = self._pending.get(sub) or self.storage._read(self.key, sub)
+        if encoded is None:
+            raise KeyError(sub)
+
+        value = self.storage._decode(encoded, self.key, sub)
+        # It's already on disk as-is, no need to write it again
+        value._encoded = (value._version, encoded)
+        self._live[sub] = value
+        return value
+
+    def _remember(self, sub, value):
+        self._cache[sub] = value
+        while len(self._cache) > self.cache_size:
+            old, record = self._cache.popitem(last=False)
+            if record.is_dirty():
+                # Nothing else might be holding on to it so it has to be captured now
+                self._pending[old] = self.storage._encode(record)
+                self.storage._request_flush()
+
+    def __getitem__(self, sub):
+        try:
+            value = self._cache[sub]
+        except KeyError:
+            value = self._load(sub)
+            self._remember(sub, value)
+        else:
+            self._cache.move_to_end(sub)
+        return value
+
+    def __setitem__(self, sub, value):
+        if sub not in self:
+            self._len += 1
+
+        self._deleted.discard(sub)
+        self._pending.pop(sub, None)
+        value._modified()
+        self._live[sub] = value
+        self._remember(sub, value)
+
+    def __delitem__(self, sub):
+        if sub not in self:
+            raise KeyError(sub)
+
+        self._cache.pop(sub, None)
+        self._live.pop(sub, None)
+        self._pending.pop(sub, None)
+        self._deleted.add(sub)
+        self._len -= 1
+
+    def __contains__(self, sub):
+        if sub in self._cache or sub in self._live or sub in self._pending:
+            return True
+        if sub in self._deleted:
+            return False
+        return self.storage._exists(self.key, sub)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        subs = set(self.storage._subs(self.key))
+        subs.update(self._live.keys())
+        subs.update(self._pending)
+        return iter(subs - self._deleted)
+
+    def items(self):
+        # Streams everything from disk without churning the cache. This still goes through
+        # every single entry so anything that runs on the loop should use SQLiteStorage.select instead.
+        live = dict(self._live.items())
+        pending = dict(self._pending)
+        for sub, encoded in self.storage._rows(self.key):
+            if sub in live or sub in self._deleted:
+                continue
+            yield sub, self.storage._decode(pending.pop(sub, encoded), self.key, sub)
+
+        for sub, encoded in pending.items():
+            if sub not in live:
+                yield sub, self.storage._decode(encoded, self.key, sub)
+
+        yield from live.items()
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def drain(self):
+        """Returns the (op, sub, encoded) changes that have to be written."""
+        for sub, value in list(self._live.items()):
+            if value.is_dirty():
+                self._pending[sub] = self.storage._encode(value)
+
+        changes = [('del', sub, None) for sub in self._deleted]
+        changes.extend(('set', sub, encoded) for sub, encoded in self._pending.items())
+        return changes
+
+    def settle(self, changes):
+        """Forgets about changes that have been written to disk."""
+        for op, sub, encoded in changes:
+            if op == 'del':
+                self._deleted.discard(sub)
+            elif self._pending.get(sub) is encoded:
+                del self._pending[sub]
+
 class Storage:
     """The "database" object. Internally based on ``json``.
 
@@ -34,58 +422,388 @@ class Storage:
 
     It must subclass StorageHook and can provide a from_json
     classmethod.
+
+    If ``journal`` is ``True`` then saving only appends the entries that
+    changed since the last save to a ``<name>.log`` file rather than rewriting
+    the entire file. Top-level dicts are journaled per entry. Once the log grows
+    past ``compact_after`` bytes it gets folded into a fresh snapshot in the
+    background.
+
+    If ``flush_interval`` is given then saving only marks the database as
+    dirty and the actual write happens at most once every ``flush_interval``
+    seconds. Call :meth:`flush` to write any pending changes right away.
     """
 
-    def __init__(self, name, *, hook=StorageHook, init=None):
+    def __init__(self, name, *, hook=StorageHook, init=None, journal=False, compact_after=4 * 1024 * 1024,
+                 flush_interval=None):
         self.name = name
         if not issubclass(hook, StorageHook):
             raise TypeError('hook has to subclass StorageHook')
 
         self.object_hook = hook.object_hook
         self.encoder = hook
+        self.hook = hook
         self.loop = asyncio.get_event_loop()
         self.lock = asyncio.Lock()
         self.init = init
+        self.journal = journal
+        self.log_name = f'{name}.log'
+        self.compact_after = compact_after
+        self._compaction = None
+        self.flush_interval = flush_interval
+        self._flusher = None
+        self._dirty = False
+        # Guards the actual file writes so flush_sync can't interleave with one from the executor
+        self._io_lock = threading.Lock()
         self.load_from_file()
 
     def load_from_file(self):
         try:
             with open(self.name, 'r') as f:
-                self._db = json.load(f, object_hook=self.object_hook)
+                self._db = self.hook.decode(json.load(f))
         except FileNotFoundError:
             if self.init is not None:
                 self._db = self.init()
             else:
                 self._db = {}
+            fresh = True
+        else:
+            fresh = False
+
+        if self.journal:
+            replayed = self._replay()
+            # A fresh database has nothing persisted so everything has to be logged on the first save
+            self._entries = {} if fresh and not replayed else self._snapshot()
+
+    def _replay(self):
+        try:
+            f = open(self.log_name, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return False
+
+        replayed = False
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write from a crash, everything after this point is garbage
+                    break
+
+                if len(record[1]) == 2:
+                    record[1][1] = self.hook.sub_key(*record[1])
+                if record[0] == 'set':
+                    record[2] = self.hook.decode(record[2], tuple(record[1]))
+
+                self._apply(record)
+                replayed = True
+        return replayed
+
+    def _apply(self, record):
+        op, (*parents, key) = record[0], record[1]
+        target = self._db
+        try:
+            for parent in parents:
+                target = target[parent]
+        except KeyError:
+            return
+
+        if op == 'set':
+            target[key] = record[2]
+        else:
+            target.pop(key, None)
+
+    def _encode(self, value):
+        # This is json.dumps except records that haven't changed re-use their previous encoding
+        if isinstance(value, Record):
+            version = value._version
+            cached = value._encoded
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+            encoded = json.dumps(value, ensure_ascii=True, cls=self.encoder, separators=(',', ':'))
+            value._encoded = (version, encoded)
+            return encoded
+
+        if type(value) is dict:
+            return '{%s}' % ','.join(f'{json.dumps(str(k))}:{self._encode(v)}' for k, v in value.items())
+        if type(value) is list:
+            return '[%s]' % ','.join(self._encode(v) for v in value)
+        return json.dumps(value, ensure_ascii=True, cls=self.encoder, separators=(',', ':'))
+
+    def _flatten(self):
+        # Plain dicts are containers whose entries get journaled individually.
+        # These are marked with None rather than an encoded value.
+        for key, value in self._db.items():
+            if type(value) is dict:
+                yield (key,), None
+                for sub, item in value.items():
+                    yield (key, sub), self._encode(item)
+            elif type(value) is PagedDict:
+                # These keep track of their own entries
+                yield (key,), None
+            else:
+                yield (key,), self._encode(value)
+
+    def _snapshot(self):
+        """Captures the database as a dict of path to encoded JSON.
+
+        This has to be called from the event loop. Since nothing else can run
+        in the meantime the result is consistent, and since it's just strings
+        it's safe to hand off to another thread while the records keep changing.
+        """
+        return dict(self._flatten())
+
+    @staticmethod
+    def _join(entries):
+        # Reassembles the document out of a snapshot
+        document = []
+        for path, encoded in entries.items():
+            key = json.dumps(str(path[-1]))
+            if len(path) == 2:
+                children.append(f'{key}:{encoded}')
+            elif encoded is None:
+                children = []
+                document.append((key, children))
+            else:
+                document.append((key, encoded))
+
+        return '{%s}' % ','.join(
+            f'{key}:{{{",".join(value)}}}' if type(value) is list else f'{key}:{value}'
+            for key, value in document
+        )
+
+    def _changes(self, current):
+        """Returns the (op, path, encoded) changes between what was last written and this snapshot.
+
+        The snapshot only counts as written once it's assigned to ``_entries``,
+        which has to wait until the write went through.
+        """
+        previous = self._entries
+        changes = []
+        for path in previous.keys() - current.keys():
+            parent = path[:-1]
+            # If the parent is gone or no longer a container then it was already overwritten
+            if not parent or (parent in current and current[parent] is None):
+                changes.append(('del', path, None))
+
+        for path, encoded in current.items():
+            if path in previous and previous[path] == encoded:
+                continue
+            changes.append(('set', path, encoded))
+        return changes
+
+    def _write_changes(self, entries):
+        lines = []
+        for op, path, encoded in self._changes(entries):
+            path = json.dumps(path, separators=(',', ':'))
+            if op == 'del':
+                lines.append('["del",%s]\n' % path)
+            else:
+                lines.append('["set",%s,%s]\n' % (path, '{}' if encoded is None else encoded))
+
+        if not lines:
+            self._entries = entries
+            return 0
+
+        with open(self.log_name, 'a', encoding='utf-8') as log:
+            start = log.tell()
+            try:
+                log.write(''.join(lines))
+                log.flush()
+            except BaseException:
+                # Half a line would hide everything appended after it from _replay
+                log.truncate(start)
+                raise
+            self._entries = entries
+            return log.tell()
+
+    def _compact(self):
+        if not self.journal:
+            # Every write is a full snapshot already
+            return
+
+        with self._io_lock:
+            # This has to be what was written last rather than a snapshot taken beforehand,
+            # e.g. flush_sync might've appended to the log in the meantime
+            self._dump(self._entries)
+            # The snapshot has everything from the log now
+            with open(self.log_name, 'w', encoding='utf-8'):
+                pass
+
+    async def compact(self):
+        """Folds the journal into a fresh snapshot."""
+        async with self.lock:
+            await self.loop.run_in_executor(None, self._compact)
 
     async def load(self):
         async with self.lock:
             await self.loop.run_in_executor(None, self.load_from_file)
 
-    def _dump(self):
+    def _dump(self, entries):
         temp = '%s-%s.tmp' % (uuid.uuid4(), self.name)
         with open(temp, 'w', encoding='utf-8') as tmp:
-            json.dump(self._db.copy(), tmp, ensure_ascii=True, cls=self.encoder, separators=(',', ':'))
+            tmp.write(self._join(entries))
 
         # atomically move the file
         os.replace(temp, self.name)
 
+    def _write(self, entries):
+        with self._io_lock:
+            if not self.journal:
+                self._dump(entries)
+                return 0
+            return self._write_changes(entries)
+
+    def _settle(self, snapshot):
+        pass
+
+    def begin(self, *, nested=False):
+        """Starts a transaction in the current task, see :meth:`transaction`.
+
+        Returns ``None`` if the task is already in one, unless ``nested`` is
+        ``True``. Otherwise the result has to be passed to :meth:`end` later on.
+        """
+        parent = _transaction.get()
+        if parent is not None and not nested:
+            return None
+
+        transaction = Transaction(self, parent)
+        transaction.token = _transaction.set(transaction)
+        return transaction
+
+    async def end(self, transaction, *, failed=False):
+        """Ends a transaction started by :meth:`begin`.
+
+        If ``failed`` is ``True`` then the changes are rolled back.
+        """
+        if transaction is None:
+            return
+
+        _transaction.reset(transaction.token)
+        if failed:
+            transaction.rollback()
+
+        if transaction.parent is not None:
+            # Whatever it saved is written along with the parent
+            transaction.parent.deferred.update(transaction.deferred)
+            return
+
+        for storage in transaction.deferred:
+            await storage.save()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, *, nested=False):
+        """Groups everything done within into a single write.
+
+        Calls to :meth:`save` within the current task are deferred until
+        the end of the block. If it raises then the fields of records and
+        the top-level keys that were written to within are rolled back to
+        what they were before, unless somebody else wrote to them in the
+        meantime. Entries added to containers in the meantime are kept.
+
+        Nested transactions are part of the outermost one. With ``nested`` set
+        to ``True`` one can be rolled back on its own though, if the outer one
+        is rolled back later on then so is everything done within it.
+        """
+        transaction = self.begin(nested=nested)
+        try:
+            yield
+        except BaseException:
+            await self.end(transaction, failed=True)
+            raise
+        else:
+            await self.end(transaction)
+
     async def save(self):
+        self._dirty = True
+        transaction = _transaction.get()
+        if transaction is not None:
+            transaction.deferred.add(self)
+            return
+
+        if self.flush_interval is None:
+            return await self.flush()
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = self.loop.create_task(self._delayed_flush())
+
+    def _request_flush(self):
+        # For when something has to be written but there's no way to await save()
+        self._dirty = True
+        if self._flusher is None or self._flusher.done():
+            self._flusher = self.loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            # Nobody awaits this task, the changes are still pending so the next save tries again
+            print(f'Could not write {self.name}:', file=sys.stderr)
+            traceback.print_exc()
+
+    async def flush(self):
+        """Writes any pending changes to disk.
+
+        If the write fails then the changes stay pending.
+        """
         async with self.lock:
-            await self.loop.run_in_executor(None, self._dump)
+            if not self._dirty:
+                return
+
+            self._dirty = False
+            snapshot = self._snapshot()
+            try:
+                size = await self.loop.run_in_executor(None, self._write, snapshot)
+            except BaseException:
+                self._dirty = True
+                raise
+            self._settle(snapshot)
+
+        if size > self.compact_after and (self._compaction is None or self._compaction.done()):
+            self._compaction = self.loop.create_task(self.compact())
+
+    def flush_sync(self):
+        """Same as :meth:`flush` except it blocks.
+
+        Useful when there's no chance to await, e.g. ``cog_unload``.
+        """
+        if self._dirty:
+            self._dirty = False
+            snapshot = self._snapshot()
+            try:
+                self._write(snapshot)
+            except BaseException:
+                self._dirty = True
+                raise
+            self._settle(snapshot)
 
     def get(self, key, *args):
         """Retrieves a config entry."""
         return self._db.get(str(key), *args)
 
-    async def put(self, key, value, *args):
-        """Edits a config entry."""
-        self._db[str(key)] = value
+    def _capture_key(self, key, value, rollback):
+        transaction = _transaction.get()
+        if rollback and transaction is not None:
+            transaction.capture_key(self, key, value)
+
+    async def put(self, key, value, *args, rollback=True):
+        """Edits a config entry.
+
+        Pass ``rollback=False`` for entries that mirror something outside of
+        the storage, so a failed transaction doesn't put the two out of sync.
+        """
+        key = str(key)
+        self._capture_key(key, value, rollback)
+        self._db[key] = value
         await self.save()
 
-    async def remove(self, key):
+    async def remove(self, key, *, rollback=True):
         """Removes a config entry."""
-        del self._db[str(key)]
+        key = str(key)
+        self._capture_key(key, _missing, rollback)
+        del self._db[key]
         await self.save()
 
     def __contains__(self, item):
@@ -99,3 +817,254 @@ class Storage:
 
     def all(self):
         return self._db
+
+class SQLiteStorage(Storage):
+    """Same as :class:`Storage` except backed by a ``sqlite3`` database in WAL mode.
+
+    Every top-level key is stored in its own row. Top-level dicts get a row
+    per entry, so e.g. updating a single participant is a single upsert.
+
+    If the database is empty and the file passed in ``migrate_from`` exists
+    then that JSON file is imported as-is.
+
+    Top-level dicts whose keys are in ``lazy`` are loaded as a
+    :class:`PagedDict` instead, keeping at most ``cache_size`` of their
+    entries in memory. Their values must be :class:`Record` instances.
+
+    ``indexes`` maps top-level dicts to fields of their entries that get
+    an index in the database, for use with :meth:`select`.
+    """
+
+    def __init__(self, name, *, migrate_from=None, lazy=(), cache_size=10000, indexes=None, **kwargs):
+        kwargs.pop('journal', None)
+        self.migrate_from = migrate_from
+        self.lazy = frozenset(lazy)
+        self.cache_size = cache_size
+        # Writes happen in the executor, they're serialised through _io_lock
+        self._conn = sqlite3.connect(name, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS records (key TEXT, sub TEXT, value TEXT NOT NULL, '
+                           'PRIMARY KEY (key, sub))')
+        for key, fields in (indexes or {}).items():
+            for field in fields:
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS "records_{key}_{field}" '
+                                   f"ON records (key, json_extract(value, '$.{field}'))")
+        # Reads go through a connection per thread so they never wait for a write to finish.
+        # WAL mode lets them see the last commit in the meantime.
+        self._local = threading.local()
+        self._readers = []
+        super().__init__(name, **kwargs)
+
+    def _reader(self):
+        try:
+            return self._local.conn
+        except AttributeError:
+            conn = self._local.conn = sqlite3.connect(self.name, check_same_thread=False, isolation_level=None)
+            self._readers.append(conn)
+            return conn
+
+    def _decode(self, value, *path):
+        return self.hook.decode(json.loads(value), path)
+
+    def load_from_file(self):
+        with self._io_lock:
+            entries = self._conn.execute('SELECT key, value FROM entries').fetchall()
+            # Lazy entries are paged in on demand
+            lazy = tuple(self.lazy)
+            query = 'SELECT key, sub, value FROM records WHERE key NOT IN (%s)' % ','.join('?' * len(lazy))
+            records = self._conn.execute(query, lazy).fetchall()
+
+        if entries:
+            # A NULL value denotes a container whose entries are in the records table
+            self._db = {}
+            for key, value in entries:
+                if value is not None:
+                    self._db[key] = self._decode(value, key)
+                elif key in self.lazy:
+                    self._db[key] = PagedDict(self, key, self.cache_size)
+                else:
+                    self._db[key] = {}
+
+            for key, sub, value in records:
+                sub = self.hook.sub_key(key, sub)
+                self._db[key][sub] = self._decode(value, key, sub)
+            self._entries = Storage._snapshot(self)
+            return
+
+        if self.migrate_from is not None and os.path.exists(self.migrate_from):
+            with open(self.migrate_from, 'r') as f:
+                self._db = self.hook.decode(json.load(f))
+        elif self.init is not None:
+            self._db = self.init()
+        else:
+            self._db = {}
+
+        for key in self.lazy:
+            data = self._db.get(key)
+            if type(data) is dict:
+                # Everything here is new so it's written out with the rest
+                self._db[key] = paged = PagedDict(self, key, self.cache_size)
+                paged._pending = {sub: self._encode(value) for sub, value in data.items()}
+                paged._len = len(data)
+
+        # Nothing is persisted yet so everything gets written
+        self._entries = {}
+        snapshot = self._snapshot()
+        self._write(snapshot)
+        self._settle(snapshot)
+
+    def _snapshot(self):
+        entries = super()._snapshot()
+        pages = [(value, value.drain()) for value in self._db.values() if type(value) is PagedDict]
+        return entries, pages
+
+    def _settle(self, snapshot):
+        _, pages = snapshot
+        for paged, changes in pages:
+            paged.settle(changes)
+
+    def _write(self, snapshot):
+        entries, pages = snapshot
+        with self._io_lock:
+            changes = self._changes(entries)
+            for paged, paged_changes in pages:
+                changes.extend((op, (paged.key, sub), encoded) for op, sub, encoded in paged_changes)
+
+            if not changes:
+                self._entries = entries
+                return 0
+
+            with self._conn:
+                self._conn.execute('BEGIN')
+                for op, path, encoded in changes:
+                    if len(path) == 2:
+                        # Entries can be keyed by anything in memory, on disk they're always text
+                        key, sub = path[0], str(path[1])
+                        if op == 'del':
+                            self._conn.execute('DELETE FROM records WHERE key = ? AND sub = ?', (key, sub))
+                        else:
+                            self._conn.execute('INSERT INTO records (key, sub, value) VALUES (?, ?, ?) '
+                                               'ON CONFLICT (key, sub) DO UPDATE SET value = excluded.value',
+                                               (key, sub, encoded))
+                        continue
+
+                    # Top-level entries replace whatever was there before, including a container's entries
+                    self._conn.execute('DELETE FROM records WHERE key = ?', path)
+                    if op == 'del':
+                        self._conn.execute('DELETE FROM entries WHERE key = ?', path)
+                    else:
+                        self._conn.execute('INSERT INTO entries (key, value) VALUES (?, ?) '
+                                           'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                                           (*path, encoded))
+            self._entries = entries
+            return 0
+
+    def _compact(self):
+        with self._io_lock:
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    # These are used by PagedDict
+
+    def _read(self, key, sub):
+        row = self._reader().execute('SELECT value FROM records WHERE key = ? AND sub = ?', (key, str(sub))).fetchone()
+        return row and row[0]
+
+    def _exists(self, key, sub):
+        row = self._reader().execute('SELECT 1 FROM records WHERE key = ? AND sub = ?', (key, str(sub))).fetchone()
+        return row is not None
+
+    def _count(self, key):
+        return self._reader().execute('SELECT COUNT(*) FROM records WHERE key = ?', (key,)).fetchone()[0]
+
+    def _subs(self, key):
+        rows = self._reader().execute('SELECT sub FROM records WHERE key = ?', (key,)).fetchall()
+        return [self.hook.sub_key(key, sub) for sub, in rows]
+
+    def _rows(self, key):
+        # A cursor rather than fetchall so the whole table is never in memory at once
+        cursor = self._reader().execute('SELECT sub, value FROM records WHERE key = ?', (key,))
+        for sub, value in cursor:
+            yield self.hook.sub_key(key, sub), value
+
+    def _query(self, query, params):
+        return self._reader().execute(query, params).fetchall()
+
+    async def select(self, key, where='1', params=(), *, order_by=None, limit=None):
+        """Returns the entries of a top-level dict that match an SQL condition.
+
+        The query runs in the executor, so this doesn't go through every entry
+        on the event loop. Fields of the entries are referred to as ``$name``,
+        e.g. ``select('participants', '$sickness > ?', (50,))``. Fields in
+        ``indexes`` can be searched without scanning the table.
+
+        Pending changes are written first. Entries that are in memory are
+        returned as-is rather than a copy read from disk.
+        """
+        await self.flush()
+        key = str(key)
+        query = f'SELECT sub, value FROM records WHERE key = ? AND ({where})'
+        if order_by is not None:
+            query = f'{query} ORDER BY {order_by}'
+        if limit is not None:
+            query = f'{query} LIMIT {int(limit)}'
+        query = _FIELD.sub(r"json_extract(value, '$.\1')", query)
+        rows = await self.loop.run_in_executor(None, self._query, query, (key, *params))
+
+        container = self._db.get(key)
+        result = []
+        for sub, value in rows:
+            sub = self.hook.sub_key(key, sub)
+            if type(container) is PagedDict:
+                try:
+                    result.append(container._live[sub])
+                    continue
+                except KeyError:
+                    value = container._pending.get(sub, value)
+            elif type(container) is dict:
+                if sub in container:
+                    result.append(container[sub])
+                continue
+            result.append(self._decode(value, key, sub))
+        return result
+
+    def fetch(self, key, sub=None):
+        """Reads an entry straight from the database rather than memory.
+
+        If ``sub`` is given then it reads that entry of a top-level dict.
+        Returns ``None`` if it isn't found.
+        """
+        path = (str(key),) if sub is None else (str(key), str(sub))
+        if sub is None:
+            row = self._reader().execute('SELECT value FROM entries WHERE key = ?', path).fetchone()
+        else:
+            row = self._reader().execute('SELECT value FROM records WHERE key = ? AND sub = ?', path).fetchone()
+
+        if row is None:
+            return None
+        if row[0] is None:
+            return self.fetch_all(key)
+        if sub is not None:
+            path = (path[0], self.hook.sub_key(*path))
+        return self._decode(row[0], *path)
+
+    def fetch_all(self, key):
+        """Reads every entry of a top-level dict straight from the database."""
+        rows = self._reader().execute('SELECT sub, value FROM records WHERE key = ?', (str(key),)).fetchall()
+        key = str(key)
+        result = {}
+        for sub, value in rows:
+            sub = self.hook.sub_key(key, sub)
+            result[sub] = self._decode(value, key, sub)
+        return result
+
+    def close(self):
+        # Everything pending is written right here, a delayed flush would find the connection closed
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self.flush_sync()
+        self._conn.close()
+        for conn in self._readers:
+            conn.close()
+        self._readers.clear()
@@ -0,0 +1,138 @@
+import math
+
+class TimerWheel:
+    """Keeps track of a lot of deadlines and tells which ones passed.
+
+    This is a hierarchical timing wheel. Time is cut into ticks of
+    ``resolution`` and every level has ``slots`` buckets, each one covering
+    ``slots`` times as many ticks as the level below. A timer goes into the
+    coarsest level that fits and moves down a level whenever its bucket
+    comes up, so adding, removing and expiring a timer are all amortized
+    O(1) no matter how many there are.
+
+    Every timer has a key, scheduling a key again replaces its timer.
+    Times are plain numbers, e.g. seconds since the epoch.
+
+    If ``listener`` is set it's called with the time of every timer that's
+    scheduled, e.g. to wake up whatever advances the wheel.
+    """
+
+    def __init__(self, now, *, resolution=1.0, slots=64, levels=4):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self._tick = math.floor(now / resolution)
+        # How many ticks a single bucket covers on every level
+        self._spans = [slots ** level for level in range(levels)]
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # Too far out for even the top level, these are placed again once they're closer
+        self._overflow = {}
+        # key -> the bucket it's in
+        self._where = {}
+        self.listener = None
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _place(self, key, tick, payload, earliest):
+        # Anything that's already due goes into the earliest bucket that's still to come
+        delta = max(tick, earliest) - self._tick
+        for level, span in enumerate(self._spans):
+            if delta < span * self.slots:
+                bucket = self._wheels[level][(max(tick, earliest) // span) % self.slots]
+                break
+        else:
+            bucket = self._overflow
+
+        bucket[key] = (tick, payload)
+        self._where[key] = bucket
+
+    def schedule(self, key, when, payload=None):
+        """Sets a timer that expires at ``when``.
+
+        Timers that are already due expire on the next tick.
+        """
+        self.cancel(key)
+        tick = math.ceil(when / self.resolution)
+        self._place(key, tick, payload, self._tick + 1)
+        if self.listener is not None:
+            self.listener(max(tick, self._tick + 1) * self.resolution)
+
+    def cancel(self, key):
+        """Removes a timer. Returns whether there was one."""
+        bucket = self._where.pop(key, None)
+        if bucket is None:
+            return False
+        del bucket[key]
+        return True
+
+    def next_deadline(self):
+        """Returns the earliest time :meth:`advance` has something to do, or ``None``.
+
+        This is when the next timer expires or when the next timers that
+        are too far out move down a level, whichever comes first. The
+        latter doesn't expire anything but asking again afterwards does
+        give a closer answer.
+        """
+        if not self._where:
+            return None
+        return self._next_tick() * self.resolution
+
+    def _next_tick(self):
+        # Every level only has to be looked at up to its first bucket that isn't empty
+        candidates = []
+        for level, span in enumerate(self._spans):
+            wheel = self._wheels[level]
+            # The first bucket to come up on this level, then every one after that
+            first = (self._tick // span + 1) * span
+            for tick in range(first, first + span * self.slots, span):
+                if wheel[(tick // span) % self.slots]:
+                    candidates.append(tick)
+                    break
+
+        if self._overflow:
+            span = self._spans[-1] * self.slots
+            candidates.append((self._tick // span + 1) * span)
+        return min(candidates)
+
+    def _cascade(self, bucket):
+        # Whatever's in here is now close enough for a finer level
+        entries = list(bucket.items())
+        bucket.clear()
+        for key, (tick, payload) in entries:
+            self._place(key, tick, payload, self._tick)
+
+    def advance(self, now):
+        """Moves the wheel up to ``now``.
+
+        Returns a list of (key, payload) for every timer that expired on the way.
+        """
+        target = math.floor(now / self.resolution)
+        expired = []
+        while self._tick < target:
+            # Nothing happens until then so there's no point in going tick by tick
+            tick = self._next_tick() if self._where else target + 1
+            if tick > target:
+                self._tick = target
+                break
+
+            self._tick = tick
+            if self._overflow and tick % (self._spans[-1] * self.slots) == 0:
+                self._cascade(self._overflow)
+
+            # The coarser levels have to go first since they can move things into the finer ones
+            for level in range(self.levels - 1, 0, -1):
+                span = self._spans[level]
+                if tick % span == 0:
+                    self._cascade(self._wheels[level][(tick // span) % self.slots])
+
+            bucket = self._wheels[0][tick % self.slots]
+            if bucket:
+                for key, (_, payload) in bucket.items():
+                    del self._where[key]
+                    expired.append((key, payload))
+                bucket.clear()
+        return expired
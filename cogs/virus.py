@@ -1,5 +1,5 @@
 from discord.ext import commands
-from collections import deque, defaultdict, Counter
+from collections import OrderedDict, defaultdict, Counter
 from collections.abc import Sequence
 from bisect import bisect_left
 
@@ -12,8 +12,11 @@ import itertools
 import asyncio
 import textwrap
 import enum
+import math
+import types
+import weakref
 
-from .utils import storage, formats
+from .utils import storage, formats, rng, timers, scheduler
 
 GENERAL_ID = 336642776609456130
 SNAKE_PIT_ID = 448285120634421278
@@ -26,6 +29,31 @@ MOD_TESTING_ID = 568662293190148106
 MAX_ALLOWED_HEALS = 3
 MAX_VACCINE = 25
 VACCINE_MILESTONES = (5, 10, 15, 20, MAX_VACCINE)
+# 0 sickness -> 0% chance, 100 sickness -> 10% chance of getting infected
+INFECTION_CUTOFF = 1000
+# Masks are 35% effective in this model
+MASK_EFFECTIVENESS = 0.35
+IMMUNOCOMPROMISED_RATE = 0.15
+SURROUND_HEALING_CHANCE = 0.1
+# How many participants are kept in memory at once
+PARTICIPANT_CACHE_SIZE = 10000
+# How many not yet stored participants are kept around
+TRANSIENT_CACHE_SIZE = 1000
+# How many of the most recent authors in a channel are considered to be in the same room
+ROOM_SIZE = 5
+# How long regular messages are collected for before they're processed together, in seconds
+INGEST_WINDOW = 0.25
+# How many regular messages a channel can have waiting before new ones have to wait
+CHANNEL_QUEUE_SIZE = 100
+# Messages by the same author in the same channel this close together are processed as one, in seconds
+BURST_WINDOW = 2.0
+# Once a channel has this many messages backed up, every burst in a batch is folded regardless of time
+# and announcements wait until it has caught up
+SHED_THRESHOLD = CHANNEL_QUEUE_SIZE // 2
+# How many of the most recent authors in a channel are remembered
+SPEAKER_INDEX_SIZE = 500
+# How long authors are remembered for after their last message
+SPEAKER_MAX_AGE = datetime.timedelta(days=1)
 
 # GENERAL_ID = 182325885867786241
 # SNAKE_PIT_ID = 182328316676538369
@@ -35,49 +63,199 @@ VACCINE_MILESTONES = (5, 10, 15, 20, MAX_VACCINE)
 # HEALER_ROLE_ID = 674854310655557633
 # DISCORD_PY = 182325885867786241
 
-def weighted_random(pairs):
+# Everything random that happens during the event comes from here so it can be replayed.
+# Rolls that happen for every message come from streams.event, the rest from the participant's own stream.
+streams = rng.Streams()
+
+class Sampler:
+    """Draws from a table of (weight, value) pairs in constant time.
+
+    This uses Vose's alias method. The weights are integers and everything is
+    done with integer arithmetic, so the distribution is exactly the same as
+    walking the table like :func:`weighted_random` used to.
+    """
+
+    def __init__(self, pairs):
+        weights = [weight for weight, _ in pairs]
+        self.values = [value for _, value in pairs]
+        self.total = total = sum(weights)
+
+        # Every column holds `total` units, split between itself and its alias
+        size = len(weights)
+        scaled = [weight * size for weight in weights]
+        self._threshold = [total] * size
+        self._alias = list(range(size))
+        small = [i for i, weight in enumerate(scaled) if weight < total]
+        large = [i for i, weight in enumerate(scaled) if weight >= total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self._threshold[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] -= total - scaled[less]
+            if scaled[more] < total:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def __call__(self, rng=random):
+        column = rng.randrange(len(self.values))
+        if rng.randrange(self.total) < self._threshold[column]:
+            return self.values[column]
+        return self.values[self._alias[column]]
+
+    def sample(self, k, rng=random):
+        """Draws k values at once."""
+        values = self.values
+        threshold = self._threshold
+        alias = self._alias
+        size = len(values)
+        total = self.total
+        randrange = rng.randrange
+        result = []
+        for _ in range(k):
+            column = randrange(size)
+            result.append(values[column] if randrange(total) < threshold[column] else values[alias[column]])
+        return result
+
+_samplers = {}
+
+def weighted_random(pairs, rng=random):
+    # Tables that are tuples are constant so their samplers can be kept around
+    if isinstance(pairs, tuple):
+        try:
+            sampler = _samplers[pairs]
+        except KeyError:
+            sampler = _samplers[pairs] = Sampler(pairs)
+        return sampler(rng)
+
     total = sum(weight for weight, _ in pairs)
-    rand = random.randint(1, total)
+    rand = rng.randint(1, total)
     for weight, value in pairs:
         rand -= weight
         if rand <= 0:
             return value
 
+def as_json(record, data_type):
+    # dataclasses.asdict deep copies everything which is wasteful since it's about to be encoded anyway
+    o = {field.name: getattr(record, field.name) for field in dataclasses.fields(record)}
+    for name in record.timestamps:
+        o[name] = storage.to_timestamp(o[name])
+    o['data_type'] = data_type
+    return o
+
 def tomorrow_date(relative=None):
     now = relative or datetime.datetime.utcnow()
     return datetime.datetime.combine(now.date(), datetime.time()) + datetime.timedelta(days=1)
 
+def epoch(dt):
+    return (dt - storage.EPOCH).total_seconds()
+
+def from_epoch(seconds):
+    return storage.EPOCH + datetime.timedelta(seconds=seconds)
+
+def expiry_deadline(name, value):
+    # Heals are counted per day, the rest are deadlines themselves
+    return tomorrow_date(value) if name == 'last_heal' else value
+
 class VirusError(commands.CommandError):
     pass
 
 class UniqueCappedList(Sequence):
+    """The most recent unique participants, oldest first.
+
+    These are indexed by member ID so checking for membership doesn't have to
+    compare whole participants, and appending someone that's already in here
+    moves them to the end again.
+    """
+
     def __init__(self, maxlen):
-        self.data = deque(maxlen=maxlen)
+        self.maxlen = maxlen
+        self.data = OrderedDict()
 
     def __getitem__(self, idx):
-        return self.data[idx]
+        return list(self.data.values())[idx]
 
     def __len__(self):
         return len(self.data)
 
     def __contains__(self, item):
-        return item in self.data
+        return item.member_id in self.data
 
     def __iter__(self):
-        return iter(self.data)
+        return iter(self.data.values())
 
     def __reversed__(self):
-        return reversed(self.data)
+        return reversed(self.data.values())
 
     def index(self, value, *args, **kwargs):
-        return self.data.index(value, *args, **kwargs)
+        return list(self.data).index(value.member_id, *args, **kwargs)
 
     def count(self, value):
-        return self.data.count(value)
+        return int(value in self)
+
+    def append(self, item):
+        """Adds or refreshes an item, returning whatever got pushed out if anything."""
+        key = item.member_id
+        data = self.data
+        if key in data:
+            data.move_to_end(key)
+            data[key] = item
+        else:
+            data[key] = item
+            if len(data) > self.maxlen:
+                return data.popitem(last=False)[1]
+
+class Room(UniqueCappedList):
+    """The last few authors in a channel and how sick they are together.
+
+    The sickness rate of every author is cached and kept up to date by the
+    participants themselves, so the infection pressure of the room is
+    available without going through everyone again.
+    """
+
+    def __init__(self, maxlen):
+        super().__init__(maxlen)
+        # member_id -> sickness_rate
+        self._rates = {}
+        self._updates = 0
+        self.total = 0.0
+
+    @property
+    def pressure(self):
+        return self.total / len(self.data) if self.data else 0.0
+
+    def rate(self, participant):
+        return self._rates[participant.member_id]
 
     def append(self, item):
-        if item not in self.data:
-            self.data.append(item)
+        previous = self.data.get(item.member_id)
+        evicted = super().append(item)
+        if evicted is not None:
+            evicted._rooms.discard(self)
+            self.total -= self._rates.pop(evicted.member_id)
+
+        if previous is item:
+            return
+
+        # Someone can be represented by a different instance than before, e.g. once they're stored
+        if previous is not None:
+            previous._rooms.discard(self)
+        if not item._rooms:
+            object.__setattr__(item, '_rooms', set())
+        item._rooms.add(self)
+        self.refresh(item)
+
+    def refresh(self, participant):
+        rate = participant.sickness_rate
+        self.total += rate - self._rates.get(participant.member_id, 0.0)
+        self._rates[participant.member_id] = rate
+
+        # Every now and then start over so floating point errors don't pile up
+        self._updates += 1
+        if self._updates >= self.maxlen:
+            self._updates = 0
+            self.total = sum(self._rates.values())
 
 class State(enum.Enum):
     alive = 0
@@ -88,8 +266,14 @@ class State(enum.Enum):
     reinfect = 5
     lose_healer = 6
 
+# Most people never get anything so they all share these until they do.
+# They're read-only so writing to them without calling mark_dirty first fails loudly.
+EMPTY_BACKPACK = types.MappingProxyType({})
+EMPTY_HEALED = ()
+
+@storage.slotted
 @dataclasses.dataclass
-class Participant:
+class Participant(storage.Record):
     member_id: int
     infected: bool = False
     healer: bool = False
@@ -98,17 +282,85 @@ class Participant:
     infected_since: typing.Optional[datetime.datetime] = None
     death: typing.Optional[datetime.datetime] = None
     sickness: int = 0
-    backpack: typing.Dict[str, bool] = dataclasses.field(default_factory=dict)
-    healed: typing.List[int] = dataclasses.field(default_factory=list)
+    backpack: typing.Dict[str, bool] = dataclasses.field(default_factory=lambda: EMPTY_BACKPACK)
+    healed: typing.List[int] = EMPTY_HEALED
     last_heal: typing.Optional[datetime.datetime] = None
     immune_until: typing.Optional[datetime.datetime] = None
     pda_cooldown: typing.Optional[datetime.datetime] = None
 
     data_type: dataclasses.InitVar[int] = 1
 
+    # These are stored as epoch timestamps
+    timestamps: typing.ClassVar[typing.Tuple[str, ...]] = (
+        'infected_since', 'death', 'last_heal', 'immune_until', 'pda_cooldown'
+    )
+
+    # _rooms are the rooms this participant was recently seen in
+    # _rng is their own stream of random numbers, made on first use
+    _defaults = {**storage.Record._defaults, '_rooms': (), '_rng': None}
+
+    @classmethod
+    def from_json(cls, data):
+        data.pop('data_type', None)
+        for name in cls.timestamps:
+            if name in data:
+                data[name] = storage.from_timestamp(data[name])
+
+        if not data.get('backpack', True):
+            data['backpack'] = EMPTY_BACKPACK
+        if not data.get('healed', True):
+            data['healed'] = EMPTY_HEALED
+
+        if data.keys() != PARTICIPANT_FIELDS or data['immunocompromised'] is None:
+            return cls(**data)
+
+        # Everything is already here so going through __init__ and __setattr__
+        # for every field is a waste when loading a lot of these
+        self = cls.__new__(cls)
+        for name, value in data.items():
+            object.__setattr__(self, name, value)
+        return self
+
     def __lt__(self, other):
         return isinstance(other, Participant) and self.member_id < other.member_id
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if self._rooms and name in SICKNESS_RATE_FIELDS:
+            for room in self._rooms:
+                room.refresh(self)
+        if name in EXPIRY_FIELDS:
+            self._schedule_expiry(name, value)
+
+    def _schedule_expiry(self, name, value):
+        key = (self.member_id, name)
+        if value is None:
+            expiries.cancel(key)
+        else:
+            expiries.schedule(key, epoch(expiry_deadline(name, value)))
+
+    def schedule_expiries(self):
+        for name in EXPIRY_FIELDS:
+            self._schedule_expiry(name, getattr(self, name))
+
+    def mark_dirty(self):
+        super().mark_dirty()
+        # This is about to be written to so it needs containers of its own
+        if self.backpack is EMPTY_BACKPACK:
+            object.__setattr__(self, 'backpack', {})
+        if self.healed is EMPTY_HEALED:
+            object.__setattr__(self, 'healed', [])
+
+    def _restore(self, state):
+        # Rooms aren't part of the transaction, only the sickness rate they see is
+        rooms = self._rooms
+        super()._restore(state)
+        if rooms:
+            object.__setattr__(self, '_rooms', rooms)
+            for room in rooms:
+                room.refresh(self)
+        self.schedule_expiries()
+
     def __post_init__(self, data_type):
         # This is pretty hard to model realistically since the definition
         # of immunocompromised depends on what type, we have
@@ -118,7 +370,19 @@ class Participant:
         # For the sake of simplicity and to make the game more fun than realistic
         # an immunodeficiency rate of ~15% was chosen.
         if self.immunocompromised is None:
-            self.immunocompromised = random.random() < 0.15
+            # People that are only looked up aren't stored, so this has to come out the same
+            # every time they're looked up again
+            fixed = streams.fixed('immunocompromised', self.member_id)
+            self.immunocompromised = fixed < IMMUNOCOMPROMISED_RATE
+
+    @property
+    def rng(self):
+        # This lives as long as the participant does, so nothing has to keep track of it otherwise
+        stream = self._rng
+        if stream is None or stream.generation != streams.generation:
+            stream = streams.participant(self.member_id)
+            object.__setattr__(self, '_rng', stream)
+        return stream
 
     def is_dead(self):
         return self.sickness >= 100
@@ -166,8 +430,9 @@ class Participant:
         self.death = datetime.datetime.utcnow()
         return True
 
-    def add_sickness(self, number=None):
-        """Increases sickness. If no number is passed then it randomly increases it.
+    def add_sickness(self, number=None, *, rolls=1):
+        """Increases sickness. If no number is passed then it randomly increases it,
+        ``rolls`` times over.
 
         Returns None if already dead, False if not dead, True if became dead.
         """
@@ -179,13 +444,13 @@ class Participant:
             return State.alive
 
         if number is None:
-            # 1% chance of gaining +3
-            # 5% chance of gaining +1
-            roll = weighted_random([(1, 'a'), (5, 'b'), (94, None)])
-            if roll == 'a':
-                self.sickness += 5 if self.immunocompromised else 3
-            elif roll == 'b':
-                self.sickness += 2 if self.immunocompromised else 1
+            # Sickness only goes up here so rolling everything at once ends up the same as one by one.
+            # This happens for every message by someone infectious so it's rolled from the event's stream.
+            for roll in SICKNESS_ROLL.sample(rolls, streams.event):
+                if roll == 'a':
+                    self.sickness += 5 if self.immunocompromised else 3
+                elif roll == 'b':
+                    self.sickness += 2 if self.immunocompromised else 1
         else:
             self.sickness += number
 
@@ -203,8 +468,7 @@ class Participant:
         # The sickness rate is the adjusted sickness
         # when accounting for certain properties like wearing
         # a mask or being a healer
-        # Masks are 35% effective in this model
-        base = self.sickness * 0.65 if self.masked else self.sickness
+        base = self.sickness * (1 - MASK_EFFECTIVENESS) if self.masked else self.sickness
         if self.healer:
             base /= 2.0
 
@@ -219,10 +483,12 @@ class Participant:
 
     def buy(self, item):
         item.in_stock -= 1
+        self.mark_dirty()
         self.backpack[item.emoji] = item.uses
 
     async def use(self, ctx, item):
         state = await item.use(ctx, self)
+        self.mark_dirty()
         self.backpack[item.emoji] -= 1
         return state
 
@@ -257,44 +523,137 @@ class Participant:
             raise VirusError("This person's already been treated today, other people need to be treated too.")
 
         self.last_heal = now
+        self.mark_dirty()
         self.healed.append(other.member_id)
         other.immune_until = now + datetime.timedelta(hours=4)
         if other.sickness != 0:
-            return other.add_sickness(random.randint(-20, -10))
+            return other.add_sickness(self.rng.randint(-20, -10))
 
     def hug(self, other):
         if other.is_infectious():
             if self.is_cured():
-                roll = random.random()
+                roll = self.rng.random()
                 if roll < 0.95:
                     return State.alive
                 return State.reinfect
             elif self.is_susceptible():
-                roll = random.random()
+                roll = self.rng.random()
                 if roll < 0.8:
                     return State.alive
                 return State.reinfect
             elif self.healer:
-                roll = random.random()
+                roll = self.rng.random()
                 if roll < 0.25:
                     return State.reinfect
                 return State.alive
 
-            return self.add_sickness(random.randint(5, 10))
+            return self.add_sickness(self.rng.randint(5, 10))
 
         if not self.is_cured() and other.healer:
-            return self.add_sickness(random.randint(-10, 5))
+            return self.add_sickness(self.rng.randint(-10, 5))
 
         return State.alive
 
     def to_json(self):
-        o = dataclasses.asdict(self)
-        o['data_type'] = 1
+        o = as_json(self, 1)
+        if o['backpack'] is EMPTY_BACKPACK:
+            o['backpack'] = {}
         return o
 
+PARTICIPANT_FIELDS = frozenset(field.name for field in dataclasses.fields(Participant))
+# 1% chance of gaining +3
+# 5% chance of gaining +1
+SICKNESS_ROLL = Sampler(((1, 'a'), (5, 'b'), (94, None)))
+# Rooms have to know when any of these change
+SICKNESS_RATE_FIELDS = frozenset(('sickness', 'masked', 'healer', 'immunocompromised'))
+# Fields that stop mattering after some time, these get cleared once they do
+EXPIRY_FIELDS = ('immune_until', 'pda_cooldown', 'last_heal')
+
+# (member_id, field) -> when it expires, for everyone in memory or found by Virus.index_expiries
+expiries = timers.TimerWheel(epoch(datetime.datetime.utcnow()))
+
+def infection_chance(room, participant):
+    """The chance of the participant getting infected by talking in this room."""
+    # Infection rate is calculated using the last ROOM_SIZE people who sent messages in the channel.
+    # We can consider it equivalent to the people in the room.
+    # Everyone has a sickness value assigned to them
+    cutoff = room.pressure / INFECTION_CUTOFF
+
+    # If we're masked we get *another* bonus
+    if participant.masked:
+        cutoff *= 1 - MASK_EFFECTIVENESS
+    return cutoff
+
+def exposures_until_infected(chance, exposures, rng):
+    """Rolls whether any of a number of exposures with the same chance infects.
+
+    Returns the number of the exposure that did it, starting at 1, or None if
+    none of them did. A single exposure is the same roll as ``rng.random() < chance``.
+    """
+    roll = rng.random()
+    if exposures == 1:
+        return 1 if roll < chance else None
+    if roll >= 1 - (1 - chance) ** exposures:
+        return None
+    if chance >= 1:
+        return 1
+    # Inverting the geometric distribution gives the first one that hit
+    return min(exposures, int(math.log1p(-roll) / math.log1p(-chance)) + 1)
+
+def coalesce(messages, window):
+    """Folds messages by the same author that are close together into one.
+
+    Returns a list of (message, count) where message is the first one of the
+    burst. If window is None then all of an author's messages are folded.
+    """
+    bursts = []
+    latest = {}
+    for message in messages:
+        author_id = message.author.id
+        index = latest.get(author_id)
+        if index is not None:
+            first, count = bursts[index]
+            if window is None or (message.created_at - first.created_at).total_seconds() <= window:
+                bursts[index] = (first, count + 1)
+                continue
 
+        latest[author_id] = len(bursts)
+        bursts.append((message, 1))
+    return bursts
+
+def surround_heal(healer, room):
+    """Rolls the passive healing a healer does on everyone in the room.
+
+    Returns a list of (participant, state) for everyone that got healed.
+    """
+    # The surround healing algorithm is based on a few things
+    # 1) a base healing rate which is inversed of the sickness
+    # 2) player based modifiers
+    # 3) an actual roll saying it's possible
+    base = healer.base_healing
+    healed = []
+    for p in list(room):
+        if p.is_infectious():
+            roll = streams.event.random()
+            if roll < SURROUND_HEALING_CHANCE:
+                state = p.add_sickness(int(-(base * (1 - room.rate(p) / 100))))
+                healed.append((p, state))
+    return healed
+
+def progress_sickness(users, amount):
+    """Adds sickness to everyone that's infectious. Returns the ones that are dead now.
+
+    Killing them is up to the caller so it can be done for everyone at once, see :meth:`Virus.kill_many`.
+    """
+    dead = []
+    for user in users:
+        if user.is_infectious() and user.add_sickness(amount) is State.dead:
+            dead.append(user)
+    return dead
+
+@storage.slotted
 @dataclasses.dataclass
-class Item:
+class Item(storage.Record):
     emoji: str
     name: str
     description: str
@@ -307,6 +666,14 @@ class Item:
 
     data_type: dataclasses.InitVar[int] = 2
 
+    timestamps: typing.ClassVar[typing.Tuple[str, ...]] = ()
+
+    _defaults = {**storage.Record._defaults, '_caller': None, '_pred': None}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(**data)
+
     def __post_init__(self, data_type):
         if self.in_stock is None:
             self.in_stock = self.total
@@ -329,9 +696,7 @@ class Item:
         self._pred = env['pred']
 
     def to_json(self):
-        o = dataclasses.asdict(self)
-        o['data_type'] = 2
-        return o
+        return as_json(self, 2)
 
     async def use(self, ctx, user):
         return await self._caller(self, ctx, user)
@@ -347,26 +712,191 @@ class Item:
                 self._pred(self, user) and
                 self.emoji not in user.backpack)
 
+@storage.slotted
 @dataclasses.dataclass
-class Stats:
+class Stats(storage.Record):
     infected: int = 0
     healers: int = 0
     dead: int = 0
     cured: int = 0
     vaccinated: int = 0
 
-    people_cured: typing.Dict[str, int] = dataclasses.field(default_factory=dict)
-    people_infected: typing.Dict[str, int] = dataclasses.field(default_factory=dict)
-    people_killed: typing.Dict[str, int] = dataclasses.field(default_factory=dict)
+    people_cured: typing.Dict[int, int] = dataclasses.field(default_factory=dict)
+    people_infected: typing.Dict[int, int] = dataclasses.field(default_factory=dict)
+    people_killed: typing.Dict[int, int] = dataclasses.field(default_factory=dict)
 
     data_type: dataclasses.InitVar[int] = 3
 
+    timestamps: typing.ClassVar[typing.Tuple[str, ...]] = ()
+
+    counters: typing.ClassVar[typing.Tuple[str, ...]] = ('people_cured', 'people_infected', 'people_killed')
+
+    @classmethod
+    def from_json(cls, data):
+        for name in cls.counters:
+            if name in data:
+                data[name] = {int(k): v for k, v in data[name].items()}
+        return cls(**data)
+
     def to_json(self):
-        o = dataclasses.asdict(self)
-        o['data_type'] = 3
-        return o
+        return as_json(self, 3)
+
+    def tally(self, counter, participant):
+        data = getattr(self, counter)
+        key = participant.member_id
+        self.mark_dirty()
+        data[key] = data.get(key, 0) + 1
+
+@storage.slotted
+@dataclasses.dataclass
+class Speakers(storage.Record):
+    """Who spoke recently in a channel, so that doesn't have to be fetched from its history."""
+
+    # member_id -> (message number, created_at) of their last message, least recent first
+    seen: typing.Dict[int, typing.Tuple[int, datetime.datetime]] = dataclasses.field(default_factory=dict)
+    # how many messages there have been in total, used to number them
+    count: int = 0
+
+    data_type: dataclasses.InitVar[int] = 4
+
+    @classmethod
+    def from_json(cls, data):
+        seen = {member_id: (number, storage.from_timestamp(when)) for member_id, number, when in data['seen']}
+        return cls(seen=seen, count=data['count'])
+
+    def to_json(self):
+        return {
+            'seen': [[member_id, number, storage.to_timestamp(when)] for member_id, (number, when) in self.seen.items()],
+            'count': self.count,
+            'data_type': 4,
+        }
+
+    def add(self, member_id, when):
+        self.mark_dirty()
+        self.count += 1
+        seen = self.seen
+        # Moving them to the end keeps this ordered by their last message
+        seen.pop(member_id, None)
+        seen[member_id] = (self.count, when)
+        if len(seen) > SPEAKER_INDEX_SIZE:
+            del seen[next(iter(seen))]
+
+        cutoff = when - SPEAKER_MAX_AGE
+        while seen:
+            oldest = next(iter(seen))
+            if seen[oldest][1] >= cutoff:
+                break
+            del seen[oldest]
+
+    def recent(self, messages, now):
+        """Returns the member IDs of everyone among the authors of the last ``messages`` messages."""
+        first = self.count - messages
+        cutoff = now - SPEAKER_MAX_AGE
+        authors = []
+        for member_id in reversed(self.seen):
+            number, when = self.seen[member_id]
+            if number <= first or when < cutoff:
+                break
+            authors.append(member_id)
+        return authors
+
+class ChannelWorker:
+    """Processes the regular messages of a single channel in batches.
+
+    Every channel gets its own queue and task so a busy or slow channel
+    doesn't hold up the rest. A batch is cut once the window is over,
+    the queue is full or someone asks for it with :meth:`flush`. Without
+    a window only the latter two apply.
+    """
+
+    def __init__(self, cog, channel_id, *, window, maxsize):
+        self.cog = cog
+        self.channel_id = channel_id
+        self.window = window
+        self.queue = asyncio.Queue(maxsize)
+        self.processed = 0
+        self.folded = 0
+        self.batches = 0
+        self.peak = 0
+        # Announcements that are held back while the channel is backed up
+        self._infected = []
+        self._dead = []
+        self._wakeup = asyncio.Event()
+        self._waiting = False
+        self._task = cog.bot.loop.create_task(self.run())
+
+    def __repr__(self):
+        return f'<ChannelWorker channel_id={self.channel_id} depth={self.queue.qsize()} peak={self.peak}>'
+
+    async def put(self, message):
+        queue = self.queue
+        if queue.full():
+            self._wakeup.set()
+        await queue.put(message)
+        self.peak = max(self.peak, queue.qsize())
+
+    async def flush(self):
+        """Processes everything that's queued right now."""
+        # Some of it might've already been taken off the queue while waiting for the window
+        if self.queue.qsize() or self._waiting:
+            self._wakeup.set()
+        await self.queue.join()
+
+    async def run(self):
+        queue = self.queue
+        while True:
+            batch = [await queue.get()]
+            if not self._wakeup.is_set():
+                self._waiting = True
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._waiting = False
+
+            self._wakeup.clear()
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+
+            overloaded = len(batch) >= SHED_THRESHOLD
+            try:
+                infected, dead, folded = await self.cog.process_messages(
+                    batch, burst_window=None if overloaded else BURST_WINDOW
+                )
+                # The day cycle goes by the role, so unlike the announcement that can't wait
+                await self.cog.add_infected_roles(infected)
+                self._infected.extend(infected)
+                self._dead.extend(dead)
+                self.folded += folded
+                # Nothing's lost by waiting since the announcements are combined anyway
+                if queue.qsize() < SHED_THRESHOLD:
+                    infected, self._infected = self._infected, []
+                    dead, self._dead = self._dead, []
+                    await self.cog.announce_changes(infected, dead)
+            except Exception:
+                # This has to keep going or the channel is stuck for good
+                await self.cog.bot.on_error('channel_worker', self.channel_id)
+            finally:
+                self.processed += len(batch)
+                self.batches += 1
+                for _ in batch:
+                    queue.task_done()
+
+    def cancel(self):
+        """Stops the worker. Returns a task announcing whatever was held back, if anything was."""
+        self._task.cancel()
+        infected, self._infected = self._infected, []
+        dead, self._dead = self._dead, []
+        if infected or dead:
+            return self.cog.bot.loop.create_task(self.cog.announce_changes(infected, dead))
 
 class VirusStorageHook(storage.StorageHook):
+    @classmethod
+    def sub_key(cls, key, sub):
+        # Participants are looked up by member ID all the time, JSON keys are only strings
+        return int(sub) if key in ('participants', 'speakers') else sub
+
     @classmethod
     def from_json(cls, data):
         try:
@@ -375,27 +905,88 @@ class VirusStorageHook(storage.StorageHook):
             return storage.StorageHook.from_json(data)
 
         if data_type == 1:
-            return Participant(**data)
+            return Participant.from_json(data)
         elif data_type == 2:
-            return Item(**data)
+            return Item.from_json(data)
         elif data_type == 3:
-            return Stats(**data)
+            return Stats.from_json(data)
+        elif data_type == 4:
+            return Speakers.from_json(data)
+
+    @classmethod
+    def decode(cls, value, path=()):
+        # The layout is known ahead of time so most things can be built directly
+        # rather than going through object_hook for every single dict.
+        if not path:
+            return {key: cls.decode(v, (key,)) for key, v in value.items()}
+
+        key = path[0]
+        if key == 'participants':
+            if len(path) == 1:
+                return {int(k): Participant.from_json(v) for k, v in value.items()}
+            return Participant.from_json(value)
+        if key == 'store':
+            # The code of an item is stored along with it, without this it'd keep running whatever it was
+            # when it was first stored, e.g. code that writes to a shared empty backpack
+            from .data import items
+            sources = {data['emoji']: data for data in items.raw}
+            for data in value:
+                source = sources.get(data['emoji'])
+                if source is not None:
+                    data['code'] = source['code']
+                    data['predicate'] = source.get('predicate')
+            return [Item.from_json(v) for v in value]
+        if key == 'stats':
+            return Stats.from_json(value)
+        if key == 'speakers':
+            if len(path) == 1:
+                return {int(k): Speakers.from_json(v) for k, v in value.items()}
+            return Speakers.from_json(value)
+        if key == 'jobs':
+            return [scheduler.Job.from_json(v) for v in value]
+        return super().decode(value, path)
 
 class Virus(commands.Cog):
     """The discord.py virus has spread and needs to be contained \N{FACE SCREAMING IN FEAR}"""
 
     def __init__(self, bot):
         self.bot = bot
-        self.storage = storage.Storage('virus.json', hook=VirusStorageHook, init=self.init_storage)
-        # last 5 (unique) authors of a message
+        self.storage = storage.SQLiteStorage('virus.db', hook=VirusStorageHook, init=self.init_storage,
+                                             migrate_from='virus.json', lazy=('participants',),
+                                             cache_size=PARTICIPANT_CACHE_SIZE, flush_interval=5.0,
+                                             indexes={'participants': ('sickness', *EXPIRY_FIELDS)})
+        # Every restart gets numbers of its own, otherwise it'd roll the same as the one before
+        streams.reseed(self.storage.get('seed'), self.storage.get('boot', 0) + 1)
+        # last ROOM_SIZE (unique) authors of a message
         # these are Participant instances
-        self._authors = defaultdict(lambda: UniqueCappedList(maxlen=5))
+        self._authors = defaultdict(lambda: Room(maxlen=ROOM_SIZE))
+        # Participants that have been looked up but never modified, so they aren't stored yet
+        self._transient = {}
+        # channel_id -> ChannelWorker, see on_regular_message
+        self._workers = {}
+        self.ingest_window = INGEST_WINDOW
+        # Messages in different channels are processed concurrently, but never two by the same member
+        self._member_locks = weakref.WeakValueDictionary()
         self._shop_restocking = False
-        self._timer_has_data = asyncio.Event()
-        self._task = bot.loop.create_task(self.day_cycle())
+        # Everything that has to happen at a certain time runs from here
+        self.scheduler = scheduler.Scheduler(self.storage, 'jobs', loop=bot.loop)
+        self.scheduler.register('day_cycle', self.run_day_cycle, catch_up='batch')
+        self.scheduler.register('restock', self.run_restock, catch_up='skip')
+        self.scheduler.register('announcement', self.run_announcement)
+        self.scheduler.register('expiries', self.run_expiries, catch_up='skip')
+        # The expiries job only runs once something is due, new deadlines might have to move it up
+        expiries.listener = self.wake_expiries
+        self._task = bot.loop.create_task(self.start_jobs())
 
     def cog_unload(self):
         self._task.cancel()
+        self.scheduler.stop()
+        expiries.listener = None
+        # Held back announcements still go out, the roles were handed out already
+        for worker in self._workers.values():
+            worker.cancel()
+        # Saves are deferred so anything pending has to be written before a reload reads the file again
+        self.storage.close()
 
     def init_storage(self):
         from .data import items
@@ -406,8 +997,12 @@ class Virus(commands.Cog):
                 Item(**data)
                 for data in items.raw
             ],
-            'next_cycle': None,
+            'jobs': [],
+            # channel_id -> Speakers
+            'speakers': {},
             'event_started': None,
+            'seed': None,
+            'boot': 0,
         }
 
     def cog_check(self, ctx):
@@ -417,9 +1012,24 @@ class Virus(commands.Cog):
         if isinstance(error, VirusError):
             await ctx.send(error)
 
+    async def cog_before_invoke(self, ctx):
+        # Every command persists once at the end, or not at all if it fails midway.
+        # Groups call this for themselves and their subcommand so only the first one counts.
+        if getattr(ctx, 'transaction', None) is None:
+            ctx.transaction = self.storage.begin()
+
+    async def cog_after_invoke(self, ctx):
+        transaction, ctx.transaction = getattr(ctx, 'transaction', None), None
+        await self.storage.end(transaction, failed=ctx.command_failed)
+
     def is_over(self):
         return self.storage['stats'].vaccinated >= MAX_VACCINE
 
+    async def reseed(self, seed=None):
+        streams.reseed(seed)
+        await self.storage.put('seed', streams.seed, rollback=False)
+        await self.storage.put('boot', streams.boot, rollback=False)
+
     @staticmethod
     def get_unique(number, elements, already_seen):
         diff = list(elements - already_seen)
@@ -428,35 +1038,143 @@ class Virus(commands.Cog):
 
         elements = []
         while number:
-            index = random.randrange(len(diff))
+            index = streams.event.randrange(len(diff))
             elements.append(diff[index])
             del diff[index]
             number -= 1
         return elements
 
     async def get_participant(self, member_id):
+        # Someone that's transient isn't stored, no point in going to disk for them
+        try:
+            return self._transient[member_id]
+        except KeyError:
+            pass
+
         participants = self.storage['participants']
-        string_id = str(member_id)
         try:
-            return participants[string_id]
+            return participants[member_id]
         except KeyError:
-            if string_id == str(self.bot.user.id):
-                raise VirusError('The evangelist cannot participate')
+            pass
+
+        if member_id == self.bot.user.id:
+            raise VirusError('The evangelist cannot participate')
 
-            participants[string_id] = participant = Participant(member_id=member_id)
-            await self.storage.put('participants', participants)
-            return participant
+        # Most people that get looked up are bystanders that never end up doing anything.
+        # Storing them right away would be a waste so they're only stored once they change.
+        participant = Participant(member_id=member_id)
+        participant._on_change = self.store_participant
+        if len(self._transient) >= TRANSIENT_CACHE_SIZE:
+            del self._transient[next(iter(self._transient))]
+        self._transient[member_id] = participant
+        return participant
 
-    async def day_cycle(self):
-        if self.storage.get('next_cycle') is None:
-            await self._timer_has_data.wait()
+    def store_participant(self, participant):
+        member_id = participant.member_id
+        self._transient.pop(member_id, None)
+        self.storage['participants'][member_id] = participant
 
+    def register_participants(self, member_ids, **attrs):
+        """Creates and stores new participants in bulk.
+
+        Any pre-existing participants are overwritten. The caller is responsible
+        for saving afterwards.
+        """
+        participants = self.storage['participants']
+        created = []
+        for member_id in member_ids:
+            self._transient.pop(member_id, None)
+            participants[member_id] = participant = Participant(member_id=member_id, **attrs)
+            created.append(participant)
+        return created
+
+    async def index_expiries(self):
+        # Deadlines are indexed as they're set, the ones from before a restart have to be looked for
+        users = {}
+        for name in EXPIRY_FIELDS:
+            # Timestamps are never negative, unlike IS NOT NULL this is a range the index can be searched with
+            for user in await self.storage.select('participants', f'${name} >= 0'):
+                users[user.member_id] = user
+
+        for user in users.values():
+            user.schedule_expiries()
+
+    async def start_jobs(self):
+        # So the next restart gets numbers of its own as well
+        await self.storage.put('boot', streams.boot, rollback=False)
+
+        # Older databases don't have this yet, it has to be there before any message comes in
+        if 'speakers' not in self.storage:
+            await self.storage.put('speakers', {})
+
+        # Older databases kept the day cycle on its own
+        next_cycle = self.storage.get('next_cycle')
+        if next_cycle is not None:
+            await self.scheduler.schedule('day_cycle', 'day_cycle', next_cycle, interval=datetime.timedelta(days=1),
+                                          replace=False)
+            await self.storage.remove('next_cycle')
+
+        # This schedules the expiries job as well. It's set up again every time so it isn't stored.
+        await self.index_expiries()
+        # Jobs that were due while the bot was down are run right away, they need the guild to be there
         await self.bot.wait_until_ready()
-        while True:
-            next_cycle = self.storage.get('next_cycle')
-            await discord.utils.sleep_until(next_cycle)
-            await self.continue_virus()
-            await self.storage.put('next_cycle', next_cycle + datetime.timedelta(days=1))
+        await self.restore_infected_roles()
+        self.scheduler.start()
+
+    def wake_expiries(self, when):
+        """Makes sure the expiries job runs by ``when``, in seconds since the epoch."""
+        if when is None:
+            return
+
+        when = from_epoch(when)
+        job = self.scheduler.get('expiries')
+        if job is None or job.when > when:
+            self.scheduler.schedule_nowait('expiries', 'expiries', when)
+
+    async def run_expiries(self, job, runs):
+        expired = expiries.advance(epoch(datetime.datetime.utcnow()))
+        if expired:
+            await self.expire([key for key, _ in expired])
+        self.wake_expiries(expiries.next_deadline())
+
+    async def expire(self, keys):
+        participants = self.storage['participants']
+        now = datetime.datetime.utcnow()
+        changed = []
+        for member_id, name in keys:
+            try:
+                user = participants[member_id]
+            except KeyError:
+                continue
+
+            # It might've been pushed back since without the timer knowing, e.g. by a rollback
+            value = getattr(user, name)
+            if value is None or expiry_deadline(name, value) > now:
+                continue
+
+            if name == 'last_heal':
+                user.healed = EMPTY_HEALED
+            setattr(user, name, None)
+            changed.append((user, name))
+
+        if changed:
+            await self.storage.save()
+            for user, name in changed:
+                # e.g. on_participant_expiry(participant, 'immune_until')
+                self.bot.dispatch('participant_expiry', user, name)
+
+    async def run_day_cycle(self, job, days):
+        await self.bot.wait_until_ready()
+        async with self.storage.transaction():
+            # Days that were missed while the bot was down are done in one go
+            await self.continue_virus(days)
+
+    async def run_restock(self, job, runs):
+        self.restock_items(job.data.get('items') or None)
+        await self.storage.save()
+
+    async def run_announcement(self, job, runs):
+        await self.log_channel.send(f'\N{CHEERING MEGAPHONE} {job.data["message"]}')
 
     @commands.group()
     @commands.is_owner()
@@ -471,11 +1189,11 @@ class Virus(commands.Cog):
         infected_ret = set()
         healers_ret = set()
         for channel_id in (GENERAL_ID, SNAKE_PIT_ID, TESTING_ID):
-            channel = guild.get_channel(channel_id)
+            # People that left since are skipped
             authors = {
-                m.author
-                async for m in channel.history(limit=500)
-                if not m.author.bot and isinstance(m.author, discord.Member)
+                member
+                for member in map(guild.get_member, self.recent_speakers(channel_id, 500))
+                if member is not None
             }
             infected_ret.update(self.get_unique(new_infected, authors, infected | healers | healers_ret | infected_ret))
             healers_ret.update(self.get_unique(new_healers, authors, infected | healers | healers_ret | infected_ret))
@@ -487,7 +1205,10 @@ class Virus(commands.Cog):
         stats.infected += len(infected_ret)
         stats.healers += len(healers_ret)
 
-        participants = self.storage['participants']
+        for p in self.register_participants(m.id for m in infected_ret):
+            p.infect()
+        self.register_participants((m.id for m in healers_ret), healer=True)
+        await self.storage.save()
 
         for member in infected_ret:
             try:
@@ -496,9 +1217,6 @@ class Virus(commands.Cog):
                 to_send.append(f'\N{CROSS MARK} Could not infect {member.mention}')
             else:
                 to_send.append(f'\N{WHITE HEAVY CHECK MARK} Infected {member.mention}')
-            finally:
-                participants[str(member.id)] = p = Participant(member_id=member.id)
-                p.infect()
 
         for member in healers_ret:
             try:
@@ -507,10 +1225,6 @@ class Virus(commands.Cog):
                 to_send.append(f'\N{CROSS MARK} Could not make {member.mention} healer')
             else:
                 to_send.append(f'\N{WHITE HEAVY CHECK MARK} Made {member.mention} healer')
-            finally:
-                participants[str(member.id)] = p = Participant(member_id=member.id, healer=True)
-
-        await self.storage.save()
 
         infected_mentions = [str(m) for m in infected_ret]
         healer_mentions = [str(m) for m in healers_ret]
@@ -525,39 +1239,37 @@ class Virus(commands.Cog):
     @virus.command(name='start')
     async def virus_start(self, ctx):
         """Starts the virus infection."""
+        await self.reseed()
         to_send = await self.new_virus_day(ctx.guild)
         if to_send:
             await ctx.send(to_send)
 
         now = ctx.message.created_at
-        next_cycle = datetime.datetime.combine(now.date(), datetime.time()) + datetime.timedelta(days=1)
         await self.storage.put('event_started', now)
-        await self.storage.put('next_cycle', next_cycle)
-        self._timer_has_data.set()
+        await self.scheduler.schedule('day_cycle', 'day_cycle', tomorrow_date(now), interval=datetime.timedelta(days=1))
 
-    async def continue_virus(self):
+    async def continue_virus(self, days=1):
         guild = self.bot.get_guild(DISCORD_PY)
         infected = set(guild.get_role(INFECTED_ROLE_ID).members)
         healers = set(guild.get_role(HEALER_ROLE_ID).members)
 
         try:
-            await self.new_virus_day(guild, infected, healers, 1, 1)
+            await self.new_virus_day(guild, infected, healers, days, days)
         except discord.HTTPException:
             pass
 
         # Infect everyone who is currently infected:
         participants = self.storage['participants']
+        users = []
         for member in infected:
             try:
-                user = participants[str(member.id)]
+                users.append(participants[member.id])
             except KeyError:
                 continue
 
-            if user.is_infectious():
-                died = user.add_sickness(15)
-                if died is State.dead:
-                    await self.kill(user)
-
+        # Sickness only goes up here so several days at once is the same as one after the other.
+        # Doing this one by one would save and announce every single death separately.
+        await self.kill_many(progress_sickness(users, 15 * days))
         await self.storage.save()
 
     def get_member(self, member_id):
@@ -597,50 +1309,72 @@ class Virus(commands.Cog):
         await self.storage.save()
         await self.send_dead_message(user)
 
-    async def cure(self, user):
-        user.sickness = 0
-        self.storage['stats'].cured += 1
+    async def kill_many(self, users):
+        killed = [user for user in users if user.kill()]
+        if not killed:
+            return
+
+        self.storage['stats'].dead += len(killed)
         await self.storage.save()
-        await self.send_cured_message(user)
+        await self.announce_dead(killed)
+
+    async def announce_dead(self, users):
+        if len(users) == 1:
+            await self.send_dead_message(users[0])
+        elif users:
+            await self.send_mass_dead_message(users)
+
+    async def announce_changes(self, infected, dead):
+        await self.announce_infected(infected)
+        await self.announce_dead(dead)
+
+    async def add_infected_roles(self, users):
+        # For people that were already infected, the roles are handed out all at once
+        async def add_role(user):
+            member = self.get_member(user.member_id)
+            if member is not None:
+                try:
+                    await member.add_roles(discord.Object(id=INFECTED_ROLE_ID))
+                except discord.HTTPException:
+                    pass
 
-    async def potentially_infect(self, channel_id, participant):
-        # Infection rate is calculated using the last 5 people who sent messages in the channel.
-        # We can consider it equivalent to the 5 people in the room.
-        # Everyone has a sickness value assigned to them
-        participants = self._authors[channel_id]
-        if len(participants) == 0:
-            return
+        await asyncio.gather(*(add_role(user) for user in users))
 
-        total_sickness = sum(p.sickness_rate for p in participants) / len(participants)
+    async def restore_infected_roles(self):
+        """Gives the infected role to everyone that's infected but doesn't have it.
 
-        # 0 sickness -> 0% chance, 100 sickness -> 10% chance
-        # of getting infected
-        cutoff = total_sickness / 1000
+        They're stored as infected before the role is added, so a restart in
+        between would leave them out of the day cycle.
+        """
+        guild = self.bot.get_guild(DISCORD_PY)
+        role = guild.get_role(INFECTED_ROLE_ID)
+        if role is None:
+            return
 
-        # If we're masked we get *another* bonus
-        if participant.masked:
-            cutoff *= 0.65
+        has_role = {member.id for member in role.members}
+        users = await self.storage.select('participants', '$infected')
+        await self.add_infected_roles([user for user in users if user.member_id not in has_role])
 
-        if random.random() < cutoff:
-            # got infected
-            await self.infect(participant)
+    async def announce_infected(self, users):
+        # The roles are already handed out by then, see add_infected_roles
+        if len(users) == 1:
+            await self.send_infect_message(users[0])
+        elif users:
+            await self.send_mass_infect_message(users)
+
+    async def cure(self, user):
+        user.sickness = 0
+        self.storage['stats'].cured += 1
+        await self.storage.save()
+        await self.send_cured_message(user)
 
     async def surround_healing(self, channel_id, healer):
         participants = self._authors[channel_id]
         if len(participants) == 0:
             return
 
-        # The surround healing algorithm is based on a few things
-        # 1) a base healing rate which is inversed of the sickness
-        # 2) player based modifiers
-        # 3) an actual roll saying it's possible
-        base = healer.base_healing
-        for p in participants:
-            if p.is_infectious():
-                roll = random.random()
-                if roll < 0.1:
-                    state = p.add_sickness(int(-(base * (1 - p.sickness_rate / 100))))
-                    await self.process_state(state, p, cause=healer)
+        for p, state in surround_heal(healer, participants):
+            await self.process_state(state, p, cause=healer)
 
         await self.storage.save()
 
@@ -651,10 +1385,11 @@ class Virus(commands.Cog):
         if not channel.permissions_for(channel.guild.me).send_messages or channel.id == EVENT_ID:
             raise VirusError("I don't know what this channel is about")
 
-        authors = {m.author async for m in channel.history(limit=100)}
-        for author in authors:
-            participant = await self.get_participant(author.id)
-            if participant.is_infectious():
+        participants = self.storage['participants']
+        for member_id in self.recent_speakers(channel.id, 100):
+            # Anyone that isn't stored has never been infected
+            participant = participants.get(member_id)
+            if participant is not None and participant.is_infectious():
                 state = participant.add_sickness(sickness)
                 await self.process_state(state, participant, cause=cause)
 
@@ -682,6 +1417,44 @@ class Virus(commands.Cog):
         except discord.HTTPException:
             pass
 
+    async def send_mass_dead_message(self, participants):
+        total = self.storage['stats'].dead
+
+        async def resolve(member_id):
+            try:
+                return str(self.bot.get_user(member_id) or await self.bot.fetch_user(member_id))
+            except discord.HTTPException:
+                return None
+
+        names = await asyncio.gather(*(resolve(p.member_id) for p in participants))
+        names = [name for name in names if name is not None]
+        if not names:
+            return
+
+        try:
+            await self.log_channel.send(f'\N{SKULL} {formats.human_join(names)} have died. {total} dead so far.')
+        except discord.HTTPException:
+            pass
+
+    async def send_mass_infect_message(self, participants):
+        total = self.storage['stats'].infected
+
+        async def resolve(member_id):
+            try:
+                return str(self.bot.get_user(member_id) or await self.bot.fetch_user(member_id))
+            except discord.HTTPException:
+                return None
+
+        names = await asyncio.gather(*(resolve(p.member_id) for p in participants))
+        names = [name for name in names if name is not None]
+        if not names:
+            return
+
+        try:
+            await self.log_channel.send(f'{formats.human_join(names)} have been infected. {total} infected so far...')
+        except discord.HTTPException:
+            pass
+
     async def send_infect_message(self, participant):
         total = self.storage['stats'].infected
 
@@ -781,22 +1554,128 @@ class Virus(commands.Cog):
         if self.is_over():
             return
 
+        # Keeping track of these here saves going through the channel history whenever recent authors are needed
+        if not message.author.bot:
+            self.note_speaker(message)
+
+        # Processing these one by one means a save and possibly an announcement for every single
+        # message, during a flood that piles up fast. Instead they're processed in batches.
+        channel_id = message.channel.id
+        try:
+            worker = self._workers[channel_id]
+        except KeyError:
+            worker = self._workers[channel_id] = ChannelWorker(self, channel_id, window=self.ingest_window,
+                                                               maxsize=CHANNEL_QUEUE_SIZE)
+        await worker.put(message)
+
+    def note_speaker(self, message):
+        speakers = self.storage['speakers']
+        channel_id = message.channel.id
+        try:
+            index = speakers[channel_id]
+        except KeyError:
+            index = speakers[channel_id] = Speakers()
+        index.add(message.author.id, message.created_at)
+
+    def recent_speakers(self, channel_id, messages):
+        """Returns the member IDs of the authors of the last ``messages`` regular messages in a channel.
+
+        Bots and anything older than :data:`SPEAKER_MAX_AGE` are left out.
+        """
+        try:
+            index = self.storage['speakers'][channel_id]
+        except KeyError:
+            return []
+        return index.recent(messages, datetime.datetime.utcnow())
+
+    async def flush_messages(self):
+        """Processes every regular message received so far."""
+        await asyncio.gather(*(worker.flush() for worker in list(self._workers.values())))
+
+    def member_lock(self, member_id):
+        try:
+            return self._member_locks[member_id]
+        except KeyError:
+            lock = self._member_locks[member_id] = asyncio.Lock()
+            return lock
+
+    async def process_messages(self, messages, *, burst_window=BURST_WINDOW):
+        """Runs the infection and healing logic for a batch of regular messages.
+
+        Messages are handled in the order they were sent, except that bursts from
+        the same author are folded into one exposure that counts for all of them,
+        see :func:`coalesce`. Storage is saved once for the whole batch.
+
+        Returns the newly infected, the newly dead and how many messages were
+        folded. Announcing them is up to the caller, see :meth:`announce_changes`.
+        """
+        infected = []
+        dead = []
+        bursts = coalesce(messages, burst_window)
+        transaction = self.storage.begin()
+        try:
+            for message, count in bursts:
+                if self.is_over():
+                    break
+
+                mark = len(infected), len(dead)
+                try:
+                    async with self.storage.transaction(nested=True):
+                        await self.process_message(message, count, infected, dead)
+                except Exception:
+                    # What it changed was undone, so it didn't infect or kill anybody either
+                    del infected[mark[0]:], dead[mark[1]:]
+                    await self.bot.on_error('regular_message', message)
+
+            killed = [user for user in dead if user.kill()]
+            if killed:
+                self.storage['stats'].dead += len(killed)
+            # The speaker index changed with every one of these
+            await self.storage.save()
+        finally:
+            # A failing message is rolled back on its own above so everything else is kept
+            await self.storage.end(transaction)
+
+        return infected, killed, len(messages) - len(bursts)
+
+    async def process_message(self, message, count, infected, dead):
+        async with self.member_lock(message.author.id):
+            await self._process_message(message, count, infected, dead)
+
+    async def _process_message(self, message, count, infected, dead):
         user = await self.get_participant(message.author.id)
+        authors = self._authors[message.channel.id]
         if user.healer:
             # This is an if block because healers can also be infected
             # which means that they should both do their passive heal and also get
             # increasingly sick
-            await self.surround_healing(message.channel.id, user)
+            for _ in range(count):
+                await self.surround_healing(message.channel.id, user)
 
-        if user.is_susceptible():
-            if user.immune_until is None or user.immune_until < message.created_at:
-                await self.potentially_infect(message.channel.id, user)
+        if user.immune_until is not None and user.immune_until >= message.created_at:
+            pass
+        elif user.is_susceptible():
+            if len(authors):
+                exposure = exposures_until_infected(infection_chance(authors, user), count, streams.event)
+                if exposure is not None:
+                    # got infected, the rest of the burst was sent while sick
+                    self.storage['stats'].infected += user.infect()
+                    await self.storage.save()
+                    infected.append(user)
+                    if exposure < count:
+                        await self._add_sickness(user, count - exposure, dead)
         elif user.is_infectious():
-            if user.immune_until is None or user.immune_until < message.created_at:
-                state = user.add_sickness()
-                await self.process_state(state, user)
+            await self._add_sickness(user, count, dead)
 
-        self._authors[message.channel.id].append(user)
+        authors.append(user)
+
+    async def _add_sickness(self, user, rolls, dead):
+        state = user.add_sickness(rolls=rolls)
+        if state is State.dead:
+            # Killing them is left until the end of the batch, until then they're as good as dead anyway
+            dead.append(user)
+        else:
+            await self.process_state(state, user)
 
     @commands.group(invoke_without_command=True, aliases=['store'])
     async def shop(self, ctx):
@@ -859,24 +1738,37 @@ class Virus(commands.Cog):
     @commands.is_owner()
     async def shop_restock(self, ctx, *items: str):
         """Control the shop."""
-        status = []
-        store = self.storage['store']
-        getter = discord.utils.get
-
-        for emoji in items:
-            item = getter(store, emoji=emoji)
-            if item is None:
-                status.append(f'{emoji}: {ctx.tick(False)}')
-            else:
-                status.append(f'{emoji}: {ctx.tick(True)}')
+        found = self.restock_items(items, unlock={'unlock': True, 'lock': False}.get(ctx.invoked_with))
+        await self.storage.save()
+        await ctx.send('\n'.join(f'{emoji}: {ctx.tick(emoji in found)}' for emoji in items))
+
+    def restock_items(self, emojis=None, *, unlock=None):
+        """Restocks the given items, or every unlocked one. Returns the emoji of the ones that exist."""
+        found = set()
+        for item in self.storage['store']:
+            if item.emoji in emojis if emojis is not None else item.unlocked:
+                found.add(item.emoji)
                 item.in_stock = item.total
-                if ctx.invoked_with == 'unlock':
-                    item.unlocked = True
-                elif ctx.invoked_with == 'lock':
-                    item.unlocked = False
+                if unlock is not None:
+                    item.unlocked = unlock
+        return found
 
-        await self.storage.save()
-        await ctx.send('\n'.join(status))
+    @shop.command(name='every')
+    @commands.is_owner()
+    async def shop_every(self, ctx, hours: float, *items: str):
+        """Restocks the shop every so often.
+
+        Without any items it restocks everything that's unlocked.
+        Pass 0 hours to stop.
+        """
+        if hours <= 0:
+            await self.scheduler.cancel('restock')
+            return await ctx.send(ctx.tick(True))
+
+        interval = datetime.timedelta(hours=hours)
+        job = await self.scheduler.schedule('restock', 'restock', datetime.datetime.utcnow() + interval,
+                                            interval=interval, data={'items': list(items)})
+        await ctx.send(f'Next restock at {job.when:%Y-%m-%d %H:%M} UTC.')
 
     @shop.command(name='refresh')
     @commands.is_owner()
@@ -962,20 +1854,12 @@ class Virus(commands.Cog):
     async def process_state(self, state, user, *, member=None, cause=None):
         if state is State.dead:
             if cause is not None:
-                data = self.storage['stats'].people_killed
-                try:
-                    data[str(cause.member_id)] += 1
-                except KeyError:
-                    data[str(cause.member_id)] = 1
+                self.storage['stats'].tally('people_killed', cause)
 
             await self.kill(user)
         elif state is State.cured:
             if cause is not None:
-                data = self.storage['stats'].people_cured
-                try:
-                    data[str(cause.member_id)] += 1
-                except KeyError:
-                    data[str(cause.member_id)] = 1
+                self.storage['stats'].tally('people_cured', cause)
 
             await self.cure(user)
         elif state is State.become_healer:
@@ -990,11 +1874,7 @@ class Virus(commands.Cog):
                 await self.send_healer_message(user)
         elif state is State.reinfect:
             if cause is not None:
-                data = self.storage['stats'].people_infected
-                try:
-                    data[str(cause.member_id)] += 1
-                except KeyError:
-                    data[str(cause.member_id)] = 1
+                self.storage['stats'].tally('people_infected', cause)
 
             await self.reinfect(user)
         elif state is State.lose_healer:
@@ -1127,17 +2007,44 @@ class Virus(commands.Cog):
             if len(authors) == 0:
                 to_send.append(f'<#{channel_id}>: 0')
             else:
-                total = sum(p.sickness_rate for p in authors) / len(authors)
-                to_send.append(f'<#{channel_id}>: {total/1000:.3%}')
+                to_send.append(f'<#{channel_id}>: {authors.pressure/INFECTION_CUTOFF:.3%}')
 
         await ctx.send('\n'.join(to_send))
 
+    @gm.command(name='queues')
+    async def gm_queues(self, ctx):
+        """Shows how backed up the message queue of every channel is."""
+        workers = sorted(self._workers.values(), key=lambda w: w.queue.qsize(), reverse=True)
+        to_send = [
+            f'<#{w.channel_id}>: {w.queue.qsize()}/{w.queue.maxsize} queued (peak {w.peak}), '
+            f'{w.processed} processed in {w.batches} batches, {w.folded} folded'
+            for w in workers[:20]
+        ]
+        await ctx.send('\n'.join(to_send) or 'Nothing yet')
+
+    @gm.command(name='later')
+    async def gm_later(self, ctx, minutes: float, *, message):
+        """Announces something via the bot some minutes from now."""
+        when = datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes)
+        await self.scheduler.schedule(f'announcement-{ctx.message.id}', 'announcement', when, data={'message': message})
+        await ctx.send(f'Will announce at {when:%Y-%m-%d %H:%M} UTC.')
+
+    @gm.command(name='jobs')
+    async def gm_jobs(self, ctx):
+        """Shows what's scheduled to happen."""
+        to_send = [
+            f'`{job.name}` ({job.kind}): {job.when:%Y-%m-%d %H:%M:%S} UTC'
+            + (f', every {job.interval}' if job.interval else '')
+            for job in self.scheduler if job.durable
+        ]
+        await ctx.send('\n'.join(to_send) or 'Nothing scheduled')
+
     @commands.command(name='stats')
     async def _stats(self, ctx):
         """Stats on the outbreak."""
 
         stats = self.storage['stats']
-        participants = self.storage['participants'].values()
+        participants = self.storage['participants']
         msg = f'Total Participants: {len(participants)}\nDead: {stats.dead}\n' \
               f'Infected: {stats.infected - stats.cured - stats.dead}\nHealers: {stats.healers}\nCured: {stats.cured}\n' \
               f'Vaccinated: {stats.vaccinated}'
@@ -1145,9 +2052,12 @@ class Virus(commands.Cog):
         e = discord.Embed(title='Stats')
         e.description = msg
 
-        infected = sorted((p for p in participants if p.is_infectious()), key=lambda p: p.sickness, reverse=True)
-        most_sick = '\n'.join(f'{i + 1}) <@{p.member_id}> [{p.sickness}]' for i, p in enumerate(infected[:5]))
-        least_sick = '\n'.join(f'{i + 1}) <@{p.member_id}> [{p.sickness}]' for i, p in enumerate(reversed(infected[-5:])))
+        # The same as Participant.is_infectious, sickness is indexed so this doesn't go through everyone
+        infectious = '$infected AND $sickness NOT IN (0, 100)'
+        most = await self.storage.select('participants', infectious, order_by='$sickness DESC', limit=5)
+        least = await self.storage.select('participants', infectious, order_by='$sickness', limit=5)
+        most_sick = '\n'.join(f'{i + 1}) <@{p.member_id}> [{p.sickness}]' for i, p in enumerate(most))
+        least_sick = '\n'.join(f'{i + 1}) <@{p.member_id}> [{p.sickness}]' for i, p in enumerate(least))
 
         e.add_field(name='Most Sick', value=most_sick or 'No one')
         e.add_field(name='Least Sick', value=least_sick or 'No one')
@@ -1183,11 +2093,11 @@ class Virus(commands.Cog):
         other = await self.get_participant(member.id)
         state = user.heal(other)
         await self.process_state(state, other, member=member, cause=user)
-        dialogue = [
+        dialogue = (
             (2, "*some sound effect*"),
             (7, "Congrats, seems like this might have done something"),
             (1, "Uh... let's just hope whatever you did worked."),
-        ]
+        )
         await ctx.send(weighted_random(dialogue))
 
     @commands.command()
@@ -1228,12 +2138,12 @@ class Virus(commands.Cog):
 
         await self.storage.save()
 
-        dialogue = [
+        dialogue = (
             (2, "Aw isn't that cute. You hugged someone!"),
             (4, "Alright alright you got your hug now scram"),
             (1, "*shudders*"),
             (3, "<:pepoS:596577130893279272>"),
-        ]
+        )
         await ctx.send(weighted_random(dialogue))
 
     @commands.command()
@@ -1262,6 +2172,7 @@ class Virus(commands.Cog):
         if item.in_stock:
             return await ctx.send('Hey, we already have some vaccines in stock right now.')
 
+        user.mark_dirty()
         for x in items:
             del user.backpack[x]
 